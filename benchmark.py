@@ -0,0 +1,221 @@
+"""
+Benchmarks for path enumeration, move selection and board updates.
+
+Every case runs in a fresh worker process, so the peak memory reported is
+its own. A case is repeated --repeat times, or more if it has not run
+for MIN_SECONDS yet, and its best time is kept. The results go to a JSON file.
+With --baseline, they are compared against an earlier results file, and
+the cases that got slower or use more memory are reported as regressions.
+
+ex: python benchmark.py --output new.json --baseline baseline.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from hex import BACKENDS, BLUE, RED, build_path_zdd, compute_optimal_move, \
+                compute_paths, find_paths
+from polygon_puzzles import ONE_TASK_PER_WORKER, finish_game_randomly, \
+                            peak_memory, puzzles
+
+GROUPS = ['paths', 'moves', 'games', 'tictactoe']
+MIN_SECONDS = 1.0  # repeat quick cases until they have run this long
+MAX_SECONDS = 10.0  # but stop repeating slow cases after this long
+MIN_MEMORY_CHANGE = 2**20  # smaller changes in peak memory are noise
+TIC_TAC_TOE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'tic-tac-toe.py')
+
+Case = Tuple[str, str, tuple]  # name, group, arguments
+
+
+def puzzle_paths(n: int, backend: str):
+    rows, cols, red_cells, blue_cells = puzzles[n]
+    if backend == 'zdd':
+        return (build_path_zdd(rows, cols, blue_cells, RED),
+                build_path_zdd(rows, cols, red_cells, BLUE))
+    return (find_paths(rows, cols, blue_cells, RED, False).paths,
+            find_paths(rows, cols, red_cells, BLUE, False).paths)
+
+
+def setup_case(group: str, args: tuple):
+    '''
+    Return a function running one repetition of a case, which returns the
+    number of paths it went through (or None), after doing the untimed
+    preparation of the case.
+    '''
+    if group == 'paths':
+        rows, cols, cell_to_avoid = args
+        # like the hex.py summary without cells to avoid, and like the
+        # polygon puzzles with them
+        return lambda: len(compute_paths(rows, cols, cell_to_avoid, RED,
+                                         not cell_to_avoid))
+
+    if group == 'moves':
+        n, backend = args
+        rows, cols, red_cells, blue_cells = puzzles[n]
+        red_paths, blue_paths = puzzle_paths(n, backend)
+
+        def run():
+            compute_optimal_move(rows, cols, set(red_cells), set(blue_cells),
+                                 red_paths, blue_paths, BLUE, backend)
+            return len(red_paths) + len(blue_paths)
+        return run
+
+    if group == 'games':
+        n, backend = args
+        rows, cols, red_cells, blue_cells = puzzles[n]
+        red_paths, blue_paths = puzzle_paths(n, backend)
+
+        def run():
+            random.seed(n)  # the same game every time
+            finish_game_randomly(rows, cols, set(red_cells), set(blue_cells),
+                                 red_paths, blue_paths, backend, show=False)
+        return run
+
+    # tic-tac-toe.py is not importable by name
+    spec = importlib.util.spec_from_file_location('tic_tac_toe', TIC_TAC_TOE)
+    tic_tac_toe = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tic_tac_toe)
+    n, = args
+
+    def run():
+        # X plays randomly, O with the potential strategy
+        random.seed(n)
+        board = tic_tac_toe.Board(n)
+        while True:
+            open_cells = board.get_open_cells()
+            board.add_move(open_cells[random.randint(0, len(open_cells)-1)],
+                           'X')
+            if board.check_for_win()[0]:
+                break
+            board.add_move(board.get_optimal_move(), 'O')
+            if board.check_for_win()[0]:
+                break
+    return run
+
+
+def run_case(case: Case, repeat: int) -> Dict:
+    name, group, args = case
+    in_use = peak_memory()
+    run = setup_case(group, args)
+    times = []
+    while sum(times) < MIN_SECONDS or \
+            (len(times) < repeat and sum(times) < MAX_SECONDS):
+        start = time.perf_counter()
+        paths = run()
+        times.append(time.perf_counter() - start)
+
+    result = {'group': group, 'seconds': min(times), 'runs': len(times),
+              'peak_bytes': max(peak_memory() - in_use, 0), 'paths': paths,
+              'paths_per_second': None}
+    if paths is not None and min(times) > 0:
+        result['paths_per_second'] = paths / min(times)
+    return result
+
+
+def build_cases(groups: List[str], max_size: int, backend: str,
+                puzzle_numbers: List[int]) -> List[Case]:
+    cases = []
+    if 'paths' in groups:
+        for n in range(3, max_size + 1):
+            cases.append(('paths/%dx%d' % (n, n), 'paths', (n, n, [])))
+            cases.append(('paths/%dx%d-avoid' % (n, n), 'paths',
+                          (n, n, [(n // 2, n // 2)])))
+    for group, prefix in (('moves', 'move'), ('games', 'finish')):
+        if group in groups:
+            for n in puzzle_numbers:
+                cases.append(('%s/puzzle-%d/%s' % (prefix, n, backend), group,
+                              (n, backend)))
+    if 'tictactoe' in groups:
+        for n in range(3, 11):
+            cases.append(('tictactoe/%dx%d' % (n, n), 'tictactoe', (n,)))
+    return cases
+
+
+def run_benchmarks(cases: List[Case], repeat: int) -> Dict[str, Dict]:
+    results = {}
+    # one case at a time, for steady timings, each in a new process
+    with ProcessPoolExecutor(max_workers=1,
+                             **ONE_TASK_PER_WORKER) as executor:
+        for case, result in zip(cases, executor.map(run_case, cases,
+                                                    [repeat] * len(cases))):
+            results[case[0]] = result
+            print('%-28s %10.4f s %10.1f MiB' % (
+                case[0], result['seconds'], result['peak_bytes'] / 2**20))
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict],
+            tolerance: float) -> List[str]:
+    '''
+    Return a description of every case of results that is more than
+    tolerance (a fraction) slower than in baseline, or that needs that
+    much more peak memory.
+    '''
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append('%s: %.4f s -> %.4f s (%+.0f%%)' % (
+                name, old['seconds'], result['seconds'],
+                100 * (result['seconds'] / old['seconds'] - 1)))
+        growth = result['peak_bytes'] - old['peak_bytes']
+        if growth > max(old['peak_bytes'] * tolerance, MIN_MEMORY_CHANGE):
+            regressions.append('%s: %.1f MiB -> %.1f MiB peak memory' % (
+                name, old['peak_bytes'] / 2**20,
+                result['peak_bytes'] / 2**20))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', nargs='+', choices=GROUPS,
+                        default=GROUPS, help='which benchmarks to run')
+    parser.add_argument('--max-size', type=int, default=8,
+                        help='largest grid for the path benchmarks')
+    parser.add_argument('--backend', choices=BACKENDS, default='tracker',
+                        help='compute_optimal_move backend for the puzzles')
+    parser.add_argument('--puzzles', type=int, nargs='+', default=None,
+                        help='polygon puzzles to use (default: up to 7x7)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case; the best time is kept')
+    parser.add_argument('--output', type=str, default='benchmark.json',
+                        help='file to write the results to')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown (as a fraction) flagged as a '
+                             'regression')
+    args = parser.parse_args()
+
+    puzzle_numbers = args.puzzles
+    if puzzle_numbers is None:
+        puzzle_numbers = [n for n in sorted(puzzles)
+                          if puzzles[n][0] * puzzles[n][1] <= 49]
+    cases = build_cases(args.groups, args.max_size, args.backend,
+                        puzzle_numbers)
+    results = run_benchmarks(cases, args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'machine': platform.machine(),
+                   'results': results}, f, indent=2)
+        f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            exit(1)
+        print('no regressions against ' + args.baseline)
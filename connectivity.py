@@ -0,0 +1,79 @@
+"""
+Union-find win detection for Hex.
+"""
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class DisjointSets:
+    ''' Union-find over 0..n-1, with union by size and path halving. '''
+    def __init__(self, n: int) -> None:
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+class Connectivity:
+    '''
+    The groups of connected stones of both players on a HexBoard. Every
+    player also has two virtual nodes, one for each edge they have to
+    connect, which every stone on that edge is joined to. A player has
+    won once their two edge nodes are in the same group, so placing a
+    stone and checking for a win takes a few near-constant-time unions
+    instead of a pass over the winning paths.
+    '''
+    def __init__(self, board, red_moves: Iterable[Hashable] = (),
+                 blue_moves: Iterable[Hashable] = ()) -> None:
+        self.index = board.index
+        self.neighbours = board.neighbours
+        size = len(board.cells)
+        self.sets = DisjointSets(size + 4)
+        self.owner: List[Optional[bool]] = [None] * size
+        # player -> (start edge node, goal edge node, start mask, goal mask)
+        self.edges: Dict[bool, Tuple[int, int, int, int]] = {}
+        for node, player in ((size, True), (size + 2, False)):
+            start, goal = board.edges(player)
+            self.edges[player] = (node, node + 1, start, goal)
+
+        for cell in red_moves:
+            self.add(cell, True)
+        for cell in blue_moves:
+            self.add(cell, False)
+
+    def add(self, cell: Hashable, player: bool) -> bool:
+        '''
+        Place a stone of player (True for Red, False for Blue) on cell, and
+        return whether player has won. Cells off the board connect nothing.
+        '''
+        i = self.index.get(cell)
+        if i is None:
+            return self.has_won(player)
+        self.owner[i] = player
+        start_node, goal_node, start, goal = self.edges[player]
+        if start >> i & 1:
+            self.sets.union(i, start_node)
+        if goal >> i & 1:
+            self.sets.union(i, goal_node)
+        for j in self.neighbours[i]:
+            if self.owner[j] == player:
+                self.sets.union(i, j)
+        return self.has_won(player)
+
+    def has_won(self, player: bool) -> bool:
+        start_node, goal_node, _, _ = self.edges[player]
+        return self.sets.find(start_node) == self.sets.find(goal_node)
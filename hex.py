@@ -5,38 +5,109 @@ Compute the lengths and total number of induced paths on a hex grid.
 NOTE: If you are running this program in a bash shell, the optional
       argument cell_to_avoid requires quotation marks around it.
       ex: python hex_v4.py 3 4 "(1, 1)"
+
+Needs Python 3.10 or newer (int.bit_count).
 """
 __author__ = "Kaylan Arnoldt-Smith"
 __email__ = "k.arnoldt.smith@mail.utoronto.ca"
 
 import argparse
+import functools
 import os
 import random
-from typing import Dict, List, Set, Tuple
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+import position_cache
+import profiler
+from connectivity import Connectivity
+from path_cache import PathCache
+from path_index import PathIndex
+from potential import PotentialTracker
+from zdd import BOTTOM, LENGTH_BITS, TOP, ZDD, unpack_lengths
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the vectorized backend
+    np = None
 
 RED = True
 BLUE = False
 possible_moves = [(0, 1), (1, 1), (1, 0), (0, -1), (-1, -1), (-1, 0)]
+BACKENDS = ['sets', 'numpy', 'tracker', 'zdd']  # for compute_optimal_move
+ENGINES = ['potential', 'mcts']  # move engines of the game loops
+SPLIT_FACTOR = 8  # chunks of the path search per worker process
 
 
 class Path:
-    def __init__(self, last: Tuple[int, int],
-                 all_but_last: Set[Tuple[int, int]]) -> None:
+    '''
+    A partial minimal path, stored as its last cell (with its cell_index)
+    and the partial path it extends, so extending a path copies nothing.
+    all_but_last is the bitmask of the cells before the last one; the set
+    of cells is only built once the path is complete.
+    '''
+    __slots__ = ('last', 'index', 'parent', 'all_but_last')
+
+    def __init__(self, last: Tuple[int, int], index: int,
+                 parent: 'Path' = None) -> None:
         self.last = last
-        self.all_but_last = all_but_last
+        self.index = index
+        self.parent = parent
+        if parent is None:
+            self.all_but_last = 0
+        else:
+            self.all_but_last = parent.all_but_last | 1 << parent.index
+
+    def is_minimal(self, neighbour_mask: int) -> bool:
+        ''' neighbour_mask: the bitmask of the neighbours of the next tile '''
+        return not neighbour_mask & self.all_but_last
 
-    def is_minimal(self, tile: Tuple[int, int]) -> bool:
-        for m in possible_moves:
-            if (tile[0] + m[0], tile[1] + m[1]) in self.all_but_last:
-                return False
-        return True
+    def all_but_last_cells(self) -> Set[Tuple[int, int]]:
+        cells = set()
+        p = self.parent
+        while p is not None:
+            cells.add(p.last)
+            p = p.parent
+        return cells
 
 
-def add_length(length: int, distr: Dict[int, int]) -> None:
+class PathFamily:
+    '''
+    The result of a path search for one player on a rows x cols grid: the
+    minimal paths found (sets of cells, or bitmasks if requested), the
+    length distribution of all minimal paths, and that of the paths
+    avoiding cell_to_avoid.
+    '''
+    def __init__(self, rows: int, cols: int, player: bool,
+                 cell_to_avoid: List[Tuple[int, int]], paths: list,
+                 all_lengths: Dict[int, int],
+                 lengths_avoiding_cell: Dict[int, int]) -> None:
+        self.rows = rows
+        self.cols = cols
+        self.player = player
+        self.cell_to_avoid = list(cell_to_avoid)
+        self.paths = paths
+        self.all_lengths = all_lengths
+        self.lengths_avoiding_cell = lengths_avoiding_cell
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __repr__(self) -> str:
+        return 'PathFamily(%dx%d, %s, %d paths of %d)' % (
+            self.rows, self.cols, 'Red' if self.player == RED else 'Blue',
+            len(self.paths), sum(self.all_lengths.values()))
+
+
+def add_length(length: int, distr: Dict[int, int], count: int = 1) -> None:
     if length in distr:
-        distr[length] += 1
+        distr[length] += count
     else:
-        distr[length] = 1
+        distr[length] = count
 
 
 def is_in_bounds(rows: int, cols: int, next_move: Tuple[int, int]) -> bool:
@@ -46,8 +117,161 @@ def is_in_bounds(rows: int, cols: int, next_move: Tuple[int, int]) -> bool:
     return False
 
 
-def print_summary(all_lengths: Dict[int, int],
-                  lengths_avoiding_cell: Dict[int, int]) -> None:
+def cell_index(cols: int, cell: Tuple[int, int]) -> int:
+    return cell[1] * cols + cell[0]
+
+
+def index_to_cell(cols: int, index: int) -> Tuple[int, int]:
+    return index % cols, index // cols
+
+
+def cells_to_mask(cols: int, cells) -> int:
+    mask = 0
+    for cell in cells:
+        mask |= 1 << cell_index(cols, cell)
+    return mask
+
+
+def mask_to_cells(mask: int, coordinates: Tuple[Tuple[int, int], ...]
+                  ) -> Set[Tuple[int, int]]:
+    ''' coordinates: the cell of every index, see get_coordinate_table '''
+    cells = set()
+    while mask:
+        low_bit = mask & -mask
+        cells.add(coordinates[low_bit.bit_length() - 1])
+        mask ^= low_bit
+    return cells
+
+
+def rotate_mask(mask: int, size: int) -> int:
+    '''
+    Rotate a bitmask of a grid with size cells by 180 degrees, which maps
+    (x, y) to (cols-1-x, rows-1-y) and so cell index i to size-1-i.
+    '''
+    return int(format(mask, '0%db' % size)[::-1], 2)
+
+
+def expand_orbits(masks: List[int], rows: int, cols: int,
+                  player: bool) -> Iterator[Set[Tuple[int, int]]]:
+    '''
+    Yield the paths of the orbits found by find_paths_bitmask(...,
+    symmetric=True): every path and, if it is different, its rotation.
+    '''
+    size = rows * cols
+    coordinates = get_coordinate_table(cols, size, player == BLUE)
+    for mask in masks:
+        rotated = rotate_mask(mask, size)
+        for path in (mask, rotated) if rotated != mask else (mask,):
+            yield mask_to_cells(path, coordinates)
+
+
+@functools.lru_cache(maxsize=None)
+def get_coordinate_table(cols: int, size: int,
+                         swapped: bool = False) -> Tuple[Tuple[int, int], ...]:
+    coordinates = []
+    for index in range(size):
+        x, y = index_to_cell(cols, index)
+        coordinates.append((y, x) if swapped else (x, y))
+    return tuple(coordinates)
+
+
+class HexBoard:
+    '''
+    The geometry of a rows x cols grid, built once per grid size by
+    get_board and shared by everything working on grids of that size.
+
+    cells[i] is the cell with cell_index i and index[cell] its index.
+    For every index, steps holds the in-bounds neighbours (in the order of
+    possible_moves) as (cell, index) pairs, neighbours their indices and
+    neighbour_masks their bitmask. Red connects first_row to last_row and
+    Blue first_col to last_col; has_left and has_right are the cells with
+    a neighbour to their left and to their right.
+    '''
+    def __init__(self, rows: int, cols: int) -> None:
+        self.rows = rows
+        self.cols = cols
+        self.cells = tuple(index_to_cell(cols, i) for i in range(rows * cols))
+        self.index = {cell: i for i, cell in enumerate(self.cells)}
+
+        steps = []
+        for x, y in self.cells:
+            lst = []
+            for m in possible_moves:
+                next_move = (x + m[0], y + m[1])
+                if is_in_bounds(rows, cols, next_move):
+                    lst.append((next_move, cell_index(cols, next_move)))
+            steps.append(tuple(lst))
+        self.steps = tuple(steps)
+        self.neighbours = tuple(tuple(i for _, i in lst) for lst in steps)
+        self.neighbour_masks = tuple(sum(1 << i for i in lst)
+                                     for lst in self.neighbours)
+
+        full = (1 << (rows * cols)) - 1
+        self.first_row = (1 << cols) - 1
+        self.last_row = self.first_row << ((rows - 1) * cols)
+        self.first_col = sum(1 << (y * cols) for y in range(rows))
+        self.last_col = self.first_col << (cols - 1)
+        self.has_left = full ^ self.first_col
+        self.has_right = full ^ self.last_col
+
+        # the order in which get_open_tiles lists the open cells
+        self.open_order = tuple((x, y) for x in range(cols)
+                                for y in range(rows))
+
+    def edges(self, player: bool) -> Tuple[int, int]:
+        ''' Return the bitmasks of the two edges player connects. '''
+        if player == RED:
+            return self.first_row, self.last_row
+        return self.first_col, self.last_col
+
+    def open_tiles(self, red_moves: Set[Tuple[int, int]],
+                   blue_moves: Set[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        return [t for t in self.open_order
+                if t not in red_moves and t not in blue_moves]
+
+    def open_cells(self, red_moves: Set[Tuple[int, int]],
+                   blue_moves: Set[Tuple[int, int]]) -> 'OpenCells':
+        return OpenCells(self.open_tiles(red_moves, blue_moves))
+
+    def connectivity(self, red_moves: Set[Tuple[int, int]],
+                     blue_moves: Set[Tuple[int, int]]) -> Connectivity:
+        return Connectivity(self, red_moves, blue_moves)
+
+
+class OpenCells:
+    '''
+    The open cells of a game, in the order of get_open_tiles, kept up to
+    date by calling take() for every stone placed instead of scanning the
+    grid again.
+    '''
+    def __init__(self, open_tiles: List[Tuple[int, int]]) -> None:
+        self.cells = dict.fromkeys(open_tiles)
+
+    def take(self, cell: Tuple[int, int]) -> None:
+        self.cells.pop(cell, None)
+
+    def tiles(self) -> List[Tuple[int, int]]:
+        return list(self.cells)
+
+    def __contains__(self, cell) -> bool:
+        return cell in self.cells
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.cells)
+
+
+@functools.lru_cache(maxsize=None)
+def get_board(rows: int, cols: int) -> HexBoard:
+    return HexBoard(rows, cols)
+
+
+def print_summary(family: PathFamily) -> None:
+    all_lengths = family.all_lengths
+    lengths_avoiding_cell = family.lengths_avoiding_cell
+    cell_to_avoid = family.cell_to_avoid
     lst = sorted(all_lengths.items(), key=lambda x: (x[0]))
     num_paths = sum(all_lengths.values())
     num_paths_avoiding_cell = sum(lengths_avoiding_cell.values())
@@ -68,11 +292,12 @@ def print_summary(all_lengths: Dict[int, int],
 
 
 def print_grid(rows: int, cols: int, red_moves: Set[Tuple[int, int]],
-               blue_moves: Set[Tuple[int, int]], print_length_distr: bool) -> None:
+               blue_moves: Set[Tuple[int, int]], print_length_distr: bool,
+               all_lengths_red: Dict[int, int] = None) -> None:
     #os.system('clear') # clear screen before printing updated grid
 
     if print_length_distr:
-        lst = sorted(all_lengths_red.items(), key=lambda x: (x[0]))
+        lst = sorted((all_lengths_red or {}).items(), key=lambda x: (x[0]))
         print("\nlength distribution of minimal winning paths remaining (Red): ")
         print(lst)
 
@@ -122,99 +347,133 @@ def print_grid(rows: int, cols: int, red_moves: Set[Tuple[int, int]],
     print(line + "\n")
 
 
+def store_lengths(player: bool, all_lengths: Dict[int, int],
+                  lengths_avoiding_cell: Dict[int, int]) -> None:
+    # only compute_paths keeps these globals
+    global all_lengths_red
+    global all_lengths_blue
+    global lengths_avoiding_cell_red
+    global lengths_avoiding_cell_blue
+
+    if player == RED:
+        all_lengths_red = all_lengths
+        lengths_avoiding_cell_red = lengths_avoiding_cell
+    else:
+        all_lengths_blue = all_lengths
+        lengths_avoiding_cell_blue = lengths_avoiding_cell
+
+
 def compute_paths(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
-                  player: bool, returning_all: bool) -> List[Set[Tuple[int, int]]]:
+                  player: bool, returning_all: bool,
+                  use_bitmask: bool = False, workers: int = 1,
+                  cache: PathCache = None, symmetric: bool = False,
+                  pruning: bool = False,
+                  stats: Dict[str, int] = None) -> List[Set[Tuple[int, int]]]:
+    '''
+    Return the paths of find_paths, and store its length distributions in
+    the globals all_lengths_red, lengths_avoiding_cell_red, etc.
+    '''
+    family = find_paths(rows, cols, cell_to_avoid, player, returning_all,
+                        use_bitmask, workers, cache, symmetric, pruning,
+                        stats)
+    store_lengths(player, family.all_lengths, family.lengths_avoiding_cell)
+    return family.paths
+
+
+@profiler.timed('find_paths')
+def find_paths(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
+               player: bool, returning_all: bool,
+               use_bitmask: bool = False, workers: int = 1,
+               cache: PathCache = None, symmetric: bool = False,
+               pruning: bool = False,
+               stats: Dict[str, int] = None) -> PathFamily:
     """ Precondition: rows > 1
     Note: This function returns all possible paths on an empty grid.
           Given a cell (or multiple cells) to avoid, it will only compute
           the length distribution of paths avoiding those cells.
+          If use_bitmask, symmetric or pruning is set, workers > 1 or a
+          cache or stats are given, the search is done by
+          find_paths_bitmask.
+          Nothing is shared between calls, so several boards and both
+          colours can be searched at once.
     """
+    if symmetric and (returning_all or not cell_to_avoid):
+        family = find_paths_bitmask(rows, cols, cell_to_avoid, player,
+                                    returning_all, workers, cache,
+                                    symmetric=True, as_masks=True,
+                                    pruning=pruning, stats=stats)
+        family.paths = list(expand_orbits(family.paths, rows, cols, player))
+        return family
+    if use_bitmask or symmetric or pruning or workers > 1 \
+            or cache is not None or stats is not None:
+        return find_paths_bitmask(rows, cols, cell_to_avoid, player,
+                                  returning_all, workers, cache,
+                                  pruning=pruning, stats=stats)
+
     q = []
     paths = []
     all_lengths = {}
     lengths_avoiding_cell = {}
-    global all_lengths_red
-    global all_lengths_blue
-    global lengths_avoiding_cell_red
-    global lengths_avoiding_cell_blue
+    board = get_board(rows, cols)
+    steps = board.steps
+    neighbour_masks = board.neighbour_masks
+    avoid_mask = avoided_mask(rows, cols, cell_to_avoid, player)
+    expanded = 0
+    minimal_checks = 0
+    sets_built = 0
 
     # add starting tiles to queue
     for i in range(0, cols):
-        new_path = Path((i, 0), set())
+        new_path = Path((i, 0), i)
         q.append(new_path)
 
     while q:
         p = q.pop() # p is a Path object containing a partial minimal path
+        expanded += 1
 
-        for m in possible_moves:
-            next_move = (p.last[0] + m[0], p.last[1] + m[1])
+        for next_move, index in steps[p.index]:
+            minimal_checks += 1
 
-            if is_in_bounds(rows, cols, next_move) and p.is_minimal(next_move):
+            if p.is_minimal(neighbour_masks[index]):
 
                 # if the next move puts us in the "goal" row
                 if next_move[1] == rows - 1:
 
-                    path_length = len(p.all_but_last) + 2
+                    path_length = p.all_but_last.bit_count() + 2
                     ok_to_add = False
 
                     # if path does not include cell to be avoided, add length
                     # to distribution of lengths of paths avoiding cell
+                    # (for Blue, avoid_mask holds the swapped cells)
                     if cell_to_avoid:
-                        ok_to_add = True
-                        for cell in cell_to_avoid:
-                            if player == RED:
-                                if next_move == cell or p.last == cell:
-                                    ok_to_add = False
-                                    break
-                                if cell in p.all_but_last:
-                                    ok_to_add = False
-                                    break
-                            else:  # player == BLUE
-                                swapped_cell = (cell[1], cell[0])
-                                if next_move == swapped_cell:
-                                    ok_to_add = False
-                                    break
-                                if p.last == swapped_cell:
-                                    ok_to_add = False
-                                    break
-                                if swapped_cell in p.all_but_last:
-                                    ok_to_add = False
-                                    break
+                        ok_to_add = not (p.all_but_last | 1 << p.index
+                                         | 1 << index) & avoid_mask
                         if ok_to_add:
                             add_length(path_length, lengths_avoiding_cell)
 
                     add_length(path_length, all_lengths)
                     if ok_to_add or returning_all:
-                        new_path = p.all_but_last.copy()
+                        sets_built += 1
+                        # a copy is sized to fit, which keeps the sets
+                        # of long paths small
+                        new_path = p.all_but_last_cells().copy()
                         new_path.add(p.last)
                         new_path.add(next_move)
                         paths.append(new_path)
 
                 # if the next move doesn't put us back in the starting row
                 elif next_move[1] != 0:
-                    ok_to_add = True
-                    if cell_to_avoid:
-                        for cell in cell_to_avoid:
-                            if player == RED:
-                                if next_move == cell:
-                                    ok_to_add = False
-                            else:  # player == BLUE
-                                swapped_cell = (cell[1], cell[0])
-                                if next_move == swapped_cell:
-                                    ok_to_add = False
+                    ok_to_add = not 1 << index & avoid_mask
                     if ok_to_add or returning_all:
                         # add path augmented with next move to queue
-                        new_path = Path(next_move, p.all_but_last.copy())
-                        new_path.all_but_last.add(p.last)
+                        new_path = Path(next_move, index, p)
                         q.append(new_path)
 
-    if player == RED:
-        all_lengths_red = all_lengths
-        lengths_avoiding_cell_red = lengths_avoiding_cell
-    else:
-        all_lengths_blue = all_lengths
-        lengths_avoiding_cell_blue = lengths_avoiding_cell
+    profiler.count('find_paths: nodes expanded', expanded)
+    profiler.count('find_paths: is_minimal checks', minimal_checks)
+    profiler.count('find_paths: path sets built', sets_built)
 
+    if player == BLUE:
         # We computed the set of Blue paths by rotating the board 90 degrees,
         # so we need to swap the coordinates of the tiles in those paths.
         # print('blue paths before swapping coordinates:')
@@ -229,33 +488,750 @@ def compute_paths(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
         # for p in paths:
         #     print(p)
 
-    return paths
+    return PathFamily(rows, cols, player, cell_to_avoid, paths, all_lengths,
+                      lengths_avoiding_cell)
+
+
+@profiler.timed('find_paths_bitmask')
+def find_paths_bitmask(rows: int, cols: int,
+                       cell_to_avoid: List[Tuple[int, int]],
+                       player: bool, returning_all: bool,
+                       workers: int = 1, cache: PathCache = None,
+                       symmetric: bool = False, as_masks: bool = False,
+                       pruning: bool = False,
+                       stats: Dict[str, int] = None) -> PathFamily:
+    '''
+    Same search as find_paths, but every cell is an integer index and
+    every partial path is a bitmask of its cells besides the last one. A
+    cell can extend the path iff its neighbour mask does not intersect the
+    path's mask, so the minimality test is a single AND. Paths are
+    converted back to sets of coordinates only once complete. For pruning
+    and stats, see walk_paths_bitmask; a cached search adds no stats.
+
+    With workers > 1 the search is split into subtrees that are searched
+    by a pool of that many processes; the paths then come out in a
+    different order. If a PathCache is given, the search is looked up in
+    it first and stored in it afterwards.
+
+    The grid is symmetric under a 180 degree rotation, which maps minimal
+    paths to minimal paths. With symmetric set, only one path of every
+    such pair (orbit) is kept, and it counts in the length distributions
+    for both; see expand_orbits. This needs returning_all or no cells to
+    avoid, since otherwise the search prunes asymmetrically. With
+    as_masks set, the paths are returned as bitmasks.
+    '''
+    avoid_mask = avoided_mask(rows, cols, cell_to_avoid, player)
+    seeds = [(i, 0, 0) for i in range(0, cols)]  # starting tiles
+    symmetric = symmetric and (returning_all or not cell_to_avoid)
+    key = (rows, cols, avoid_mask, bool(cell_to_avoid), returning_all,
+           symmetric)
+    entry = cache.get(*key) if cache is not None else None
+
+    if entry is not None:
+        masks, all_lengths, lengths_avoiding_cell = entry
+    elif workers > 1:
+        masks, all_lengths, lengths_avoiding_cell = search_paths_parallel(
+            rows, cols, seeds, avoid_mask, bool(cell_to_avoid),
+            returning_all, workers, symmetric, pruning, stats)
+    else:
+        masks, all_lengths, lengths_avoiding_cell, _ = search_paths_bitmask(
+            rows, cols, seeds, avoid_mask, bool(cell_to_avoid), returning_all,
+            symmetric=symmetric, pruning=pruning, stats=stats)
+    if cache is not None and entry is None:
+        cache.put(*key, masks, all_lengths, lengths_avoiding_cell)
+
+    if as_masks:
+        return PathFamily(rows, cols, player, cell_to_avoid, masks,
+                          all_lengths, lengths_avoiding_cell)
+
+    coordinates = get_coordinate_table(cols, rows * cols, player == BLUE)
+    paths = [mask_to_cells(path, coordinates) for path in masks]
+    return PathFamily(rows, cols, player, cell_to_avoid, paths, all_lengths,
+                      lengths_avoiding_cell)
+
+
+def iter_paths(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
+               player: bool, returning_all: bool, as_masks: bool = False,
+               pruning: bool = False,
+               stats: Dict[str, int] = None) -> Iterator[Set[Tuple[int, int]]]:
+    '''
+    Yield the paths compute_paths would return, in the same order as
+    find_paths_bitmask, one at a time as the search finds them, so that
+    memory does not grow with the number of paths. The length
+    distributions are not stored; see summarize_paths. With as_masks set,
+    the paths are yielded as bitmasks of the searched (for Blue,
+    transposed) grid. For pruning and stats, see walk_paths_bitmask.
+    '''
+    avoid_mask = avoided_mask(rows, cols, cell_to_avoid, player)
+    seeds = [(i, 0, 0) for i in range(0, cols)]  # starting tiles
+    coordinates = get_coordinate_table(cols, rows * cols, player == BLUE)
+
+    for path in walk_paths_bitmask(rows, cols, seeds, avoid_mask,
+                                   returning_all, pruning=pruning,
+                                   stats=stats):
+        if not returning_all and (not cell_to_avoid or path & avoid_mask):
+            continue
+        yield path if as_masks else mask_to_cells(path, coordinates)
+
+
+@profiler.timed('summarize_paths')
+def summarize_paths(rows: int, cols: int,
+                    cell_to_avoid: List[Tuple[int, int]], player: bool,
+                    pruning: bool = False,
+                    stats: Dict[str, int] = None) -> PathFamily:
+    '''
+    Return the length distributions of all minimal paths and of those
+    avoiding cell_to_avoid as a PathFamily without paths, streaming the
+    paths from iter_paths instead of keeping them.
+    '''
+    avoid_mask = avoided_mask(rows, cols, cell_to_avoid, player)
+    all_lengths = {}
+    lengths_avoiding_cell = {}
+
+    for path in iter_paths(rows, cols, [], player, True, as_masks=True,
+                           pruning=pruning, stats=stats):
+        path_length = path.bit_count()
+        add_length(path_length, all_lengths)
+        if cell_to_avoid and not path & avoid_mask:
+            add_length(path_length, lengths_avoiding_cell)
+
+    return PathFamily(rows, cols, player, cell_to_avoid, [], all_lengths,
+                      lengths_avoiding_cell)
+
+
+def flood(mask: int, allowed: int, cols: int, has_left: int, has_right: int,
+          target: int = 0) -> int:
+    '''
+    Grow mask one ring of neighbours at a time through the cells of
+    allowed, until it stops growing or meets target. Return the result.
+    '''
+    while not mask & target:
+        left = mask & has_left
+        right = mask & has_right
+        grown = mask | (allowed & (mask << cols | mask >> cols
+                                   | right << 1 | right << (cols + 1)
+                                   | left >> 1 | left >> (cols + 1)))
+        if grown == mask:
+            break
+        mask = grown
+    return mask
+
+
+def get_usable_cells(rows: int, cols: int, avoid_mask: int,
+                     returning_all: bool) -> int:
+    '''
+    Return the bitmask of the cells past the first row that a partial path
+    can be extended through: every cell of the last row, and the other
+    cells (outside avoid_mask, unless returning_all is set) that connect
+    to both the first and the last row. No minimal path uses the rest.
+    '''
+    board = get_board(rows, cols)
+    first_row, last_row = board.first_row, board.last_row
+    has_left, has_right = board.has_left, board.has_right
+    middle = ((1 << (rows * cols)) - 1) ^ first_row ^ last_row
+    if not returning_all:
+        middle &= ~avoid_mask
+    from_start = flood(first_row, middle, cols, has_left, has_right)
+    from_goal = flood(last_row, middle, cols, has_left, has_right)
+    return (from_start & from_goal & middle) | last_row
+
+
+def walk_paths_bitmask(rows: int, cols: int, q: List[Tuple[int, int, int]],
+                       avoid_mask: int, returning_all: bool,
+                       max_length: int = 0,
+                       unfinished: List[Tuple[int, int, int]] = None,
+                       pruning: bool = False,
+                       stats: Dict[str, int] = None) -> Iterator[int]:
+    '''
+    Run the depth-first search of find_paths_bitmask from the partial
+    paths in q and yield the bitmask of every minimal path as soon as it is
+    reached. A partial path is a triple (last cell index, bitmask of the
+    other cells, bitmask of the neighbours of those cells). Unless
+    returning_all is set, partial paths are not extended through
+    avoid_mask. If max_length is set, the partial paths of that many cells
+    are appended to unfinished instead of being extended.
+
+    With pruning set, cells that no minimal path can use are removed up
+    front (see get_usable_cells), and a partial path is dropped as soon as
+    the last row can no longer be reached from its last cell without
+    touching the neighbours of the other cells. Neither changes the paths
+    found. If stats is given, the numbers of partial paths expanded and
+    dropped are added to its 'expanded' and 'pruned' entries.
+    '''
+    board = get_board(rows, cols)
+    neighbours = board.neighbours
+    neighbour_masks = board.neighbour_masks
+    goal_row_start = (rows - 1) * cols
+    last_row, has_left, has_right = \
+        board.last_row, board.has_left, board.has_right
+    if pruning:
+        usable = get_usable_cells(rows, cols, avoid_mask, returning_all)
+    elif returning_all:
+        usable = (1 << (rows * cols)) - 1
+    else:
+        usable = ~avoid_mask
+    is_usable = [bool(usable >> i & 1) for i in range(rows * cols)]
+    expanded = 0
+    pruned = 0
+
+    while q:
+        last, all_but_last, near = q.pop()
+        last_bit = 1 << last
+        near |= neighbour_masks[last]
+        expanded += 1
+
+        for next_move in neighbours[last]:
+            if neighbour_masks[next_move] & all_but_last:
+                continue  # not minimal
+
+            if next_move >= goal_row_start:
+                yield all_but_last | last_bit | (1 << next_move)
+
+            elif next_move >= cols and is_usable[next_move]:
+                if pruning:
+                    free = usable & ~near
+                    ahead = neighbour_masks[next_move] & free
+                    if not ahead & last_row and not flood(
+                            ahead, free, cols, has_left, has_right,
+                            last_row) & last_row:
+                        pruned += 1  # cut off from the last row
+                        continue
+                new_path = (next_move, all_but_last | last_bit, near)
+                if all_but_last.bit_count() + 2 == max_length:
+                    unfinished.append(new_path)
+                else:
+                    q.append(new_path)
+
+    if stats is not None:
+        stats['expanded'] = stats.get('expanded', 0) + expanded
+        stats['pruned'] = stats.get('pruned', 0) + pruned
+    profiler.count('walk_paths_bitmask: nodes expanded', expanded)
+    profiler.count('walk_paths_bitmask: nodes pruned', pruned)
+
+
+def search_paths_bitmask(rows: int, cols: int, q: List[Tuple[int, int, int]],
+                         avoid_mask: int, avoiding: bool, returning_all: bool,
+                         max_length: int = 0, symmetric: bool = False,
+                         pruning: bool = False, stats: Dict[str, int] = None):
+    '''
+    Run the search of find_paths_bitmask from the partial paths in q.
+    Return the bitmasks of the paths found, the length distributions of
+    all of them and of those avoiding avoid_mask (if avoiding is set), and
+    the partial paths of max_length cells, which are not extended if
+    max_length is set. If symmetric is set, only the path of each rotation
+    orbit with the smaller start + goal index (or the smaller bitmask, on
+    a tie) is kept.
+    '''
+    size = rows * cols
+    paths = []
+    all_lengths = {}
+    lengths_avoiding_cell = {}
+    unfinished = []
+
+    for path in walk_paths_bitmask(rows, cols, q, avoid_mask, returning_all,
+                                   max_length, unfinished, pruning, stats):
+        path_length = path.bit_count()
+        orbit = (path,)
+        if symmetric:
+            # the start is the lowest cell and the goal the highest
+            turned = (path & -path).bit_length() + path.bit_length() - 1 - size
+            if turned > 0:
+                continue  # the rotated path is the one we keep
+            rotated = None  # only needed on a tie or to avoid cells
+            if turned == 0 or avoiding:
+                rotated = rotate_mask(path, size)
+                if turned == 0 and rotated < path:
+                    continue
+            if rotated != path:
+                orbit = (path, rotated)
+
+        ok_to_add = False
+        if avoiding:
+            ok_to_add = not path & avoid_mask
+            avoiders = sum(not p & avoid_mask for p in orbit)
+            if avoiders:
+                add_length(path_length, lengths_avoiding_cell, avoiders)
+
+        add_length(path_length, all_lengths, len(orbit))
+        if ok_to_add or returning_all:
+            paths.append(path)
+
+    return paths, all_lengths, lengths_avoiding_cell, unfinished
+
+
+def search_paths_task(args):
+    # run by the worker processes of search_paths_parallel
+    stats = {}
+    return search_paths_bitmask(*args, stats=stats)[:3] + (stats,)
+
+
+def merge_lengths(distr: Dict[int, int], other: Dict[int, int]) -> None:
+    for length, count in other.items():
+        distr[length] = distr.get(length, 0) + count
+
+
+def search_paths_parallel(rows: int, cols: int,
+                          seeds: List[Tuple[int, int, int]],
+                          avoid_mask: int, avoiding: bool,
+                          returning_all: bool, workers: int,
+                          symmetric: bool = False, pruning: bool = False,
+                          stats: Dict[str, int] = None):
+    '''
+    Run search_paths_bitmask from seeds across a pool of worker processes.
+    The partial paths are first extended one cell at a time until there
+    are SPLIT_FACTOR times as many as workers, so that the work can be
+    balanced, then dealt round-robin into SPLIT_FACTOR chunks per worker.
+    '''
+    paths, all_lengths, lengths_avoiding_cell = [], {}, {}
+    length = 1
+    while seeds and len(seeds) < SPLIT_FACTOR * workers:
+        length += 1
+        found, found_lengths, found_avoiding, seeds = search_paths_bitmask(
+            rows, cols, seeds, avoid_mask, avoiding, returning_all, length,
+            symmetric, pruning, stats)
+        paths.extend(found)
+        merge_lengths(all_lengths, found_lengths)
+        merge_lengths(lengths_avoiding_cell, found_avoiding)
+
+    num_chunks = min(len(seeds), SPLIT_FACTOR * workers)
+    tasks = [(rows, cols, seeds[i::num_chunks], avoid_mask, avoiding,
+              returning_all, 0, symmetric, pruning)
+             for i in range(num_chunks)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for found, found_lengths, found_avoiding, found_stats in executor.map(
+                search_paths_task, tasks):
+            paths.extend(found)
+            merge_lengths(all_lengths, found_lengths)
+            merge_lengths(lengths_avoiding_cell, found_avoiding)
+            if stats is not None:
+                merge_lengths(stats, found_stats)
+
+    return paths, all_lengths, lengths_avoiding_cell
+
+
+# Flags of a counting state (see count_induced_paths)
+START_USED = 1
+GOAL_USED = 2
+CLOSED = 4
+
+
+def advance_frontier(frontier: List[int], entry: int, flags: int, left: int,
+                     rows: int, cols: int):
+    '''
+    Shift the frontier of count_induced_paths by one cell: the cell with
+    index left drops out and entry is appended. Return the new state, or
+    None if the cell that drops out makes the state invalid.
+    '''
+    leaving = frontier[0]
+    rest = frontier[1:]
+    rest.append(entry)
+
+    if leaving:
+        # the degree of a cell is final once it leaves the frontier
+        required = 1 if left // cols in (0, rows - 1) else 2
+        if leaving & 3 != required:
+            return None
+        label = leaving >> 2
+        if not any(e >> 2 == label for e in rest):
+            # the component is finished, so it must be the whole path
+            if any(rest):
+                return None
+            flags |= CLOSED
+
+    # relabel components in order of appearance
+    labels = {}
+    for i, e in enumerate(rest):
+        if e:
+            label = labels.setdefault(e >> 2, len(labels) + 1)
+            rest[i] = (label << 2) | (e & 3)
+    return tuple(rest), flags
+
+
+def frontier_successors(frontier: Tuple[int, ...], flags: int, v: int,
+                        rows: int, cols: int, forbidden: Set[int]):
+    '''
+    Return the states of count_induced_paths after deciding that cell v is
+    not on the path and that it is, in that order. A state is None if it
+    cannot lead to a minimal path. Indices v >= rows * cols only push the
+    last cells out of the frontier.
+    '''
+    x, y = index_to_cell(cols, v)
+    left = v - (cols + 1)
+
+    # v is not on the path
+    without_v = advance_frontier(list(frontier), 0, flags, left, rows, cols)
+
+    if v >= rows * cols or v in forbidden or flags & CLOSED:
+        return without_v, None
+    if y == 0:
+        if flags & START_USED:
+            return without_v, None
+        flags |= START_USED
+    if y == rows - 1:
+        if flags & GOAL_USED:
+            return without_v, None
+        flags |= GOAL_USED
+
+    # v is on the path: join it to its chosen earlier neighbours, which
+    # sit at frontier positions 0 (x-1, y-1), 1 (x, y-1) and cols (x-1, y)
+    neighbours = []
+    if x > 0:
+        neighbours.append(cols)
+    if y > 0:
+        neighbours.append(1)
+    if x > 0 and y > 0:
+        neighbours.append(0)
+    new_frontier = list(frontier)
+    labels = set()
+    degree = 0
+    for i in neighbours:
+        e = new_frontier[i]
+        if not e:
+            continue
+        neighbour_row = (left + i) // cols
+        limit = 1 if neighbour_row in (0, rows - 1) else 2
+        if e >> 2 in labels or (e & 3) == limit:
+            return without_v, None  # a cycle or too many neighbours
+        labels.add(e >> 2)
+        new_frontier[i] = e + 1
+        degree += 1
+
+    if degree > (1 if y in (0, rows - 1) else 2):
+        return without_v, None
+    if labels:
+        label = min(labels)
+        for i, e in enumerate(new_frontier):
+            if e >> 2 in labels:
+                new_frontier[i] = (label << 2) | (e & 3)
+    else:
+        label = max(e >> 2 for e in new_frontier) + 1
+    with_v = advance_frontier(new_frontier, (label << 2) | degree, flags,
+                              left, rows, cols)
+    return without_v, with_v
+
+
+def count_induced_paths(rows: int, cols: int,
+                        forbidden: Set[int] = frozenset()) -> Dict[int, int]:
+    '''
+    Return the length distribution of the minimal paths found by
+    compute_paths that use no cell index in forbidden, without listing
+    the paths. Precondition: rows > 1
+
+    The minimal paths are exactly the induced paths with one end in the
+    bottom row, the other end in the top row and every other cell in
+    between. We decide the cells one at a time in index order, keeping a
+    frontier of the last cols + 1 cells. Every chosen frontier cell stores
+    its degree so far (edges between chosen cells are forced, since the
+    path is induced) and a label of its connected component. A component
+    that leaves the frontier must be the whole path. The counts for every
+    length are packed into one integer, LENGTH_BITS bits per length.
+    '''
+    states = {((0,) * (cols + 1), 0): 1}
+
+    for v in range(rows * cols + cols + 1):
+        new_states = {}
+        for (frontier, flags), counts in states.items():
+            without_v, with_v = frontier_successors(frontier, flags, v,
+                                                    rows, cols, forbidden)
+            if without_v:
+                new_states[without_v] = new_states.get(without_v, 0) + counts
+            if with_v:
+                new_states[with_v] = new_states.get(with_v, 0) \
+                                     + (counts << LENGTH_BITS)
+        states = new_states
+
+    packed = sum(counts for (_, flags), counts in states.items()
+                 if flags & CLOSED)
+    return unpack_lengths(packed)
+
+
+def avoided_indices(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
+                    player: bool) -> Set[int]:
+    forbidden = set()
+    for cell in cell_to_avoid:
+        if player == BLUE:
+            cell = (cell[1], cell[0])
+        if is_in_bounds(rows, cols, cell):
+            forbidden.add(cell_index(cols, cell))
+    return forbidden
+
+
+def avoided_mask(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
+                 player: bool) -> int:
+    ''' Return the bitmask of avoided_indices. '''
+    mask = 0
+    for i in avoided_indices(rows, cols, cell_to_avoid, player):
+        mask |= 1 << i
+    return mask
+
+
+@profiler.timed('count_path_lengths')
+def count_path_lengths(rows: int, cols: int,
+                       cell_to_avoid: List[Tuple[int, int]],
+                       player: bool) -> PathFamily:
+    '''
+    Counting-only version of find_paths(..., returning_all=True): return
+    the length distributions of all minimal paths and of those avoiding
+    cell_to_avoid as a PathFamily without paths, without enumerating them.
+    '''
+    all_lengths = count_induced_paths(rows, cols)
+    lengths_avoiding_cell = {}
+    if cell_to_avoid:
+        forbidden = avoided_indices(rows, cols, cell_to_avoid, player)
+        lengths_avoiding_cell = count_induced_paths(rows, cols, forbidden)
+
+    return PathFamily(rows, cols, player, cell_to_avoid, [], all_lengths,
+                      lengths_avoiding_cell)
+
+
+@profiler.timed('build_path_zdd')
+def build_path_zdd(rows: int, cols: int, cell_to_avoid: List[Tuple[int, int]],
+                   player: bool) -> ZDD:
+    '''
+    Return the minimal paths avoiding cell_to_avoid (as listed by
+    compute_paths) as a ZDD over board cells, without listing them. The nodes
+    are the states of count_induced_paths, merged level by level and then
+    reduced bottom-up.
+    '''
+    forbidden = avoided_indices(rows, cols, cell_to_avoid, player)
+    size = rows * cols
+    family = ZDD(get_coordinate_table(cols, size, player == BLUE))
+
+    # forward pass: number the states of every level and record where
+    # each one goes, with -1 for a dead end
+    levels = []
+    states = {((0,) * (cols + 1), 0): 0}
+    for v in range(size + cols + 1):
+        new_states = {}
+        lo_ids = array('l')
+        hi_ids = array('l')
+        for frontier, flags in states:
+            without_v, with_v = frontier_successors(frontier, flags, v,
+                                                    rows, cols, forbidden)
+            lo_ids.append(new_states.setdefault(without_v, len(new_states))
+                          if without_v else -1)
+            hi_ids.append(new_states.setdefault(with_v, len(new_states))
+                          if with_v else -1)
+        levels.append((lo_ids, hi_ids))
+        states = new_states
+
+    # backward pass: build the reduced nodes of every level from the ones
+    # of the level below
+    below = [TOP if flags & CLOSED else BOTTOM for _, flags in states]
+    for v in reversed(range(len(levels))):
+        lo_ids, hi_ids = levels.pop()
+        nodes = []
+        for lo, hi in zip(lo_ids, hi_ids):
+            lo = below[lo] if lo >= 0 else BOTTOM
+            hi = below[hi] if hi >= 0 else BOTTOM
+            nodes.append(family.table.make_node(v, lo, hi) if v < size
+                         else lo)
+        below = nodes
+    family.root = below[0]
+    return family
 
 
 def get_open_tiles(rows: int, cols: int, red_moves: Set[Tuple[int, int]],
                    blue_moves: Set[Tuple[int, int]]) -> List[Tuple[int, int]]:
-    open_tiles = []
-    for x in range(0, cols):
-        for y in range(0, rows):
-            if (x, y) not in red_moves and (x, y) not in blue_moves:
-                open_tiles.append((x, y))
-    return open_tiles
+    return get_board(rows, cols).open_tiles(red_moves, blue_moves)
+
+
+def index_paths(paths):
+    '''
+    Return a list of paths as a PathIndex, for remove_paths_through to
+    update in place. A ZDD is returned as it is.
+    '''
+    if isinstance(paths, (ZDD, PathIndex)):
+        return paths
+    return PathIndex(paths)
+
+
+def remove_paths_through(paths, cell: Tuple[int, int]):
+    '''
+    Return the paths (a list, a PathIndex or a ZDD) that do not contain
+    cell. A PathIndex is updated in place (see PathIndex.undo) and
+    returned, which only touches the paths through cell.
+    '''
+    if isinstance(paths, ZDD):
+        return paths.restrict(cell)
+    if isinstance(paths, PathIndex):
+        profiler.count('remove_paths_through: paths killed',
+                       paths.block(cell))
+        return paths
+    profiler.count('remove_paths_through: paths scanned', len(paths))
+    return [p for p in paths if cell not in p]
+
+
+def length_histogram(paths: Iterable[Set[Tuple[int, int]]]) -> Dict[int, int]:
+    '''
+    Return the length distribution of paths, which may be any iterable
+    (e.g. iter_paths) of sets of cells or of bitmasks.
+    '''
+    lengths = {}
+    for path in paths:
+        add_length(path.bit_count() if isinstance(path, int) else len(path),
+                   lengths)
+    return lengths
+
+
+def cell_frequencies(paths: Iterable[Set[Tuple[int, int]]]
+                     ) -> Dict[Tuple[int, int], int]:
+    ''' Return the number of paths through every cell used by one. '''
+    frequencies = {}
+    for path in paths:
+        for cell in path:
+            frequencies[cell] = frequencies.get(cell, 0) + 1
+    return frequencies
 
 
-def compute_potential(paths: List[Set[Tuple[int, int]]],
+def compute_potential(paths: Iterable[Set[Tuple[int, int]]],
                       moves: Set[Tuple[int, int]]):
+    '''
+    Return the sum of (1/2)^(# of cells not in moves) over paths, which may
+    be a ZDD or any iterable of sets of cells, e.g. iter_paths.
+    '''
+    if isinstance(paths, ZDD):
+        return paths.potential(moves)
     potential = 0
     for path in paths:
         potential += (1 / 2) ** (len(path.difference(moves)))
     return potential
 
 
+class PathMatrix:
+    '''
+    A paths x cells incidence matrix of a list of winning paths on a
+    rows x cols grid, with cells numbered by cell_index.
+    '''
+    def __init__(self, rows: int, cols: int,
+                 paths: List[Set[Tuple[int, int]]]) -> None:
+        if np is None:
+            raise ImportError("numpy is required for the vectorized backend")
+        self.rows = rows
+        self.cols = cols
+        self.sizes = np.fromiter((len(p) for p in paths), dtype=np.int64,
+                                 count=len(paths))
+        path_ids = np.repeat(np.arange(len(paths)), self.sizes)
+        cell_ids = np.fromiter((cell_index(cols, tile)
+                                for p in paths for tile in p),
+                               dtype=np.int64, count=len(path_ids))
+        self.matrix = np.zeros((len(paths), rows * cols), dtype=np.uint8)
+        self.matrix[path_ids, cell_ids] = 1
+
+    def cell_vector(self, cells) -> np.ndarray:
+        vector = np.zeros(self.rows * self.cols, dtype=np.int64)
+        for cell in cells:
+            vector[cell_index(self.cols, cell)] = 1
+        return vector
+
+    def weights(self, moves: Set[Tuple[int, int]]) -> np.ndarray:
+        '''
+        Return (1/2)^(# of cells of the path not in moves) for every path.
+        '''
+        remaining = self.sizes - self.matrix @ self.cell_vector(moves)
+        return np.ldexp(1.0, -remaining)
+
+    def potential_gains(self, weights: np.ndarray) -> np.ndarray:
+        '''
+        Return, for every cell, how much the potential grows when that
+        cell is added to the moves the weights were computed from: every
+        path through the cell loses one remaining cell, so its weight
+        doubles.
+        '''
+        return weights @ self.matrix
+
+
+def compute_optimal_move_numpy(rows: int, cols: int,
+                               red_moves: Set[Tuple[int, int]],
+                               blue_moves: Set[Tuple[int, int]],
+                               red_paths: List[Set[Tuple[int, int]]],
+                               blue_paths: List[Set[Tuple[int, int]]],
+                               turn: bool,
+                               open_tiles: List[Tuple[int, int]] = None):
+    '''
+    Vectorized version of compute_optimal_move. The potential after every
+    candidate move is read off one matrix-vector product with the
+    opposing player's path incidence matrix instead of one pass over the
+    paths per candidate.
+    '''
+    if turn == RED:
+        opposing_player_moves = blue_moves
+        opposing_player_paths = blue_paths
+    else:  # turn == BLUE
+        opposing_player_moves = red_moves
+        opposing_player_paths = red_paths
+
+    if open_tiles is None:
+        open_tiles = get_open_tiles(rows, cols, red_moves, blue_moves)
+    open_indices = np.array([cell_index(cols, t) for t in open_tiles],
+                            dtype=np.int64)
+    path_matrix = PathMatrix(rows, cols, opposing_player_paths)
+    weights = path_matrix.weights(opposing_player_moves)
+
+    # find a move that maximizes the opposing player's potential
+    potentials = weights.sum() + path_matrix.potential_gains(weights)
+    best = int(np.argmax(potentials[open_indices]))
+    next_move = open_tiles[best]
+
+    # find the new max value for the potential function after the opposing
+    # player's next move, among the paths that avoid next_move
+    alive = path_matrix.matrix[:, open_indices[best]] == 0
+    weights = np.where(alive, weights, 0.0)
+    potentials = weights.sum() + path_matrix.potential_gains(weights)
+    open_indices = np.delete(open_indices, best)
+    final_move_potential = float(max(potentials[open_indices].max(), 0))
+
+    return next_move, final_move_potential
+
+
+def compute_optimal_move_tracked(tracker: PotentialTracker,
+                                 open_tiles: List[Tuple[int, int]]):
+    '''
+    Same strategy as compute_optimal_move, read off a PotentialTracker
+    of the opposing player's paths. The tracker is left unchanged.
+    '''
+    next_move, _ = tracker.best_cell(open_tiles)
+
+    # find the new max value for the potential function after the opposing
+    # player's next move
+    tracker.block(next_move)
+    remaining_tiles = [t for t in open_tiles if t != next_move]
+    if remaining_tiles:
+        _, final_move_potential = tracker.best_cell(remaining_tiles)
+    else:
+        final_move_potential = tracker.potential()
+    tracker.unblock(next_move)
+
+    return next_move, final_move_potential
+
+
+def compute_optimal_move_zdd(paths: ZDD, moves: Set[Tuple[int, int]],
+                             open_tiles: List[Tuple[int, int]]):
+    '''
+    Same strategy as compute_optimal_move, for a ZDD of the opposing
+    player's paths and the cells the opposing player occupies.
+    '''
+    _, cell_weights = paths.weights(moves)
+    next_move = max(open_tiles, key=lambda t: cell_weights.get(t, 0))
+
+    # find the new max value for the potential function after the opposing
+    # player's next move
+    total, cell_weights = paths.restrict(next_move).weights(moves)
+    best = max((cell_weights.get(t, 0) for t in open_tiles if t != next_move),
+               default=0)
+
+    return next_move, (total + best) / (1 << len(paths.cells))
+
+
+@profiler.timed('compute_optimal_move')
+@position_cache.cached
 def compute_optimal_move(rows: int, cols: int,
                          red_moves: Set[Tuple[int, int]],
                          blue_moves: Set[Tuple[int, int]],
                          red_paths: List[Set[Tuple[int, int]]],
                          blue_paths: List[Set[Tuple[int, int]]],
-                         turn: bool):
+                         turn: bool, backend: str = 'sets',
+                         open_tiles: List[Tuple[int, int]] = None):
     '''
     Compute the optimal next move according to the Erdos-Selfridge
     potential strategy. Return the next move and the Erdos-Selfridge
@@ -267,7 +1243,34 @@ def compute_optimal_move(rows: int, cols: int,
     blue_moves: The cells already occupied by blue
     paths: The opposing player's remaining possible winning paths
     turn: Whose turn it is
+    backend: 'sets' to loop over the paths for every candidate move,
+             'numpy' for compute_optimal_move_numpy, 'tracker' for
+             compute_optimal_move_tracked or 'zdd' for
+             compute_optimal_move_zdd (the paths are then ZDDs)
+    open_tiles: The open cells in the order of get_open_tiles (e.g. the
+                tiles() of an OpenCells), if the caller keeps track of them
     '''
+    if open_tiles is None:
+        open_tiles = get_open_tiles(rows, cols, red_moves, blue_moves)
+    else:
+        open_tiles = list(open_tiles)  # not changed for the caller
+
+    if backend == 'numpy':
+        return compute_optimal_move_numpy(rows, cols, red_moves, blue_moves,
+                                          red_paths, blue_paths, turn,
+                                          open_tiles)
+    if backend == 'tracker':
+        profiler.count('compute_optimal_move: paths indexed',
+                       len(blue_paths if turn == RED else red_paths))
+        if turn == RED:
+            tracker = PotentialTracker(blue_paths, claimed=blue_moves)
+        else:  # turn == BLUE
+            tracker = PotentialTracker(red_paths, claimed=red_moves)
+        return compute_optimal_move_tracked(tracker, open_tiles)
+    if backend == 'zdd':
+        if turn == RED:
+            return compute_optimal_move_zdd(blue_paths, blue_moves, open_tiles)
+        return compute_optimal_move_zdd(red_paths, red_moves, open_tiles)
 
     if turn == RED:
         current_player_moves = red_moves
@@ -281,7 +1284,8 @@ def compute_optimal_move(rows: int, cols: int,
         opposing_player_paths = red_paths
 
     # initialize variables
-    open_tiles = get_open_tiles(rows, cols, red_moves, blue_moves)
+    profiler.count('compute_optimal_move: path differences',
+                   len(opposing_player_paths) * len(open_tiles))
     next_move = open_tiles[0]
     next_move_potential = 0
     opposing_player_moves.add(next_move)
@@ -306,6 +1310,8 @@ def compute_optimal_move(rows: int, cols: int,
     open_tiles.remove(next_move)
     new_opposing_paths = [p for p in opposing_player_paths if next_move not in p]
     #print("new opposing paths: " + str(new_opposing_paths))
+    profiler.count('compute_optimal_move: path differences',
+                   len(new_opposing_paths) * len(open_tiles))
     final_move = open_tiles[0]
     final_move_potential = 0
 
@@ -337,8 +1343,32 @@ if __name__ == "__main__":
                         help='enable interactive mode')
     parser.add_argument('--visual', action='store_true',
                         help='enable visual mode')
+    parser.add_argument('--engine', choices=ENGINES, default='potential',
+                        help='how option 3 of interactive mode picks moves: '
+                             'the potential strategy or a Monte Carlo tree '
+                             'search')
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='seconds of tree search per move with '
+                             '--engine mcts')
+    parser.add_argument('--bitmask', action='store_true',
+                        help='use the bitmask path search')
+    parser.add_argument('--count', action='store_true',
+                        help='count the paths instead of listing them')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes for the path search')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep computed paths in the on-disk path cache')
+    parser.add_argument('--symmetric', action='store_true',
+                        help='search one path per 180 degree rotation orbit')
+    parser.add_argument('--prune', action='store_true',
+                        help='prune dead ends of the path search and report '
+                             'the number of search nodes')
+    parser.add_argument('--profile', action='store_true',
+                        help='print where the time went at exit')
 
     args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
     rows = args.rows
     cols = args.cols
     cell_to_avoid = []
@@ -348,20 +1378,27 @@ if __name__ == "__main__":
             cell_to_avoid.append((x, y))
     interactive = args.interactive
     visual = args.visual
-
-    all_lengths_red = {}
-    lengths_avoiding_cell_red = {}
-    all_lengths_blue = {}
-    lengths_avoiding_cell_blue = {}
+    bitmask = args.bitmask
+    count = args.count
+    workers = args.workers
+    cache = PathCache() if args.cache else None
+    symmetric = args.symmetric
+    pruning = args.prune
+    stats = {} if pruning else None
 
     if interactive:
         game_over = 0 # initialize game loop
         turn = RED # red goes first
         red_moves = set()
         blue_moves = set()
+        board = get_board(rows, cols)
+        open_cells = board.open_cells(red_moves, blue_moves)
+        connectivity = board.connectivity(red_moves, blue_moves)
 
         # Compute sets of minimal winning paths for Red and Blue
-        red_paths = compute_paths(rows, cols, [], RED, True)
+        red_family = find_paths(rows, cols, [], RED, True, bitmask, workers,
+                                cache, symmetric)
+        red_paths = red_family.paths
         if rows == cols:
             blue_paths = red_paths.copy()  # saves time on large grids
             for i in range(0, len(blue_paths)):
@@ -370,14 +1407,33 @@ if __name__ == "__main__":
                     path.add((tile[1], tile[0]))
                 blue_paths[i] = path
         else:
-            blue_paths = compute_paths(cols, rows, [], BLUE, True)
+            blue_paths = find_paths(cols, rows, [], BLUE, True, bitmask,
+                                    workers, cache, symmetric).paths
+
+        search = None
+        if args.engine == 'mcts':
+            from mcts import MCTS  # mcts imports this module
+            search = MCTS(rows, cols, red_moves, blue_moves, turn, red_paths,
+                          blue_paths)
+
+        # Blue's potential for the potential strategy, kept up to date as
+        # stones are placed instead of being rebuilt for every move
+        blue_tracker = PotentialTracker(blue_paths)
+
+        # index the paths by cell, so that a move only touches the
+        # opponent's paths through it and their length distribution is
+        # kept up to date
+        red_paths = PathIndex(red_paths)
+        blue_paths = PathIndex(blue_paths)
+        all_lengths_red = red_paths.lengths
 
         while not game_over:
 
             # print game state and get user input
             while True:
                 if visual:
-                    print_grid(rows, cols, red_moves, blue_moves, True)
+                    print_grid(rows, cols, red_moves, blue_moves, True,
+                               all_lengths_red)
                 else:
                     lst = sorted(all_lengths_red.items(), key=lambda x: (x[0]))
                     print("\nlength distribution of minimal winning paths remaining (Red): ")
@@ -393,7 +1449,9 @@ if __name__ == "__main__":
 
                 print("(1) Place a stone at (x,y)")
                 print("(2) Place a random stone")
-                if turn == RED:
+                if turn == RED and search is not None:
+                    print("(3) Play the tree search's move")
+                elif turn == RED:
                     print("(3) Play the potential strategy")
                 print("(x) Exit")
 
@@ -411,7 +1469,7 @@ if __name__ == "__main__":
                     try:
                         x, y = (int(c.strip("()[] ")) for c in input("Please enter x,y coordinates: ").split(','))
                         next_move = (x, y)
-                        if is_in_bounds(rows, cols, next_move) and next_move not in red_moves | blue_moves:
+                        if next_move in open_cells:
                             break
                         else:
                             print("Invalid move. Please try again.")
@@ -420,70 +1478,58 @@ if __name__ == "__main__":
 
             # choose a random tile
             elif opt == '2':
-                open_tiles = get_open_tiles(rows, cols, red_moves, blue_moves)
+                open_tiles = open_cells.tiles()
                 next_move = open_tiles[random.randint(0, len(open_tiles)-1)]
 
+            # play the tree search's move
+            elif opt == '3' and search is not None:
+                next_move, _ = search.best_move(args.budget)
+
             # play the potential strategy
             elif opt == '3' and turn == RED:
-                next_move, _ = compute_optimal_move(rows, cols,
-                                                    red_moves, blue_moves,
-                                                    blue_paths, turn)
+                next_move, _ = compute_optimal_move_tracked(
+                    blue_tracker, open_cells.tiles())
+            open_cells.take(next_move)
+            if search is not None:
+                search.play(next_move)  # keeps the subtree of next_move
 
             if turn == RED:
                 red_moves.add(next_move)
 
-                # check win condition
-                for path in red_paths:
-                    if path.issubset(red_moves):
-                        game_over = True
-                        endgame_message = "Red wins!"
-                        if visual: # add color
-                            endgame_message = "\033[0;31m" + endgame_message + "\033[0m"
-
-                # remove minimal winning paths containing new Red
-                # tile from Blue's path set
-                new_blue_paths = [p for p in blue_paths if next_move not in p]
-                blue_paths = new_blue_paths
-
-                # rebuild path length dictionary
-                all_lengths_blue = {}
-                for path in blue_paths:
-                    path_length = len(path)
-                    if path_length in all_lengths_blue:
-                        all_lengths_blue[path_length] += 1
-                    else:
-                        all_lengths_blue[path_length] = 1
+                # check win condition; Blue's paths are not shown, so
+                # they are only updated while the game goes on
+                if connectivity.add(next_move, RED):
+                    game_over = True
+                    endgame_message = "Red wins!"
+                    if visual: # add color
+                        endgame_message = "\033[0;31m" + endgame_message + "\033[0m"
+                else:
+                    # remove minimal winning paths containing new Red
+                    # tile from Blue's path set
+                    blue_paths.block(next_move)
+                    blue_tracker.block(next_move)
 
             else:
                 blue_moves.add(next_move)
+                blue_tracker.claim(next_move)
 
                 # check win condition
-                for path in blue_paths:
-                    if path.issubset(blue_moves):
-                        game_over = True
-                        endgame_message = "Blue wins!"
-                        if visual: # add color
-                            endgame_message = "\033[34m" + \
-                                              endgame_message + \
-                                              "\033[0m"
+                if connectivity.add(next_move, BLUE):
+                    game_over = True
+                    endgame_message = "Blue wins!"
+                    if visual: # add color
+                        endgame_message = "\033[34m" + \
+                                          endgame_message + \
+                                          "\033[0m"
 
                 # remove minimal winning paths containing new Blue
-                # tile from Red's path set
-                new_red_paths = [p for p in red_paths if next_move not in p]
-                red_paths = new_red_paths
-
-                # rebuild path length dictionary
-                all_lengths_red = {}
-                for path in red_paths:
-                    path_length = len(path)
-                    if path_length in all_lengths_red:
-                        all_lengths_red[path_length] += 1
-                    else:
-                        all_lengths_red[path_length] = 1
+                # tile from Red's path set (which also updates
+                # all_lengths_red)
+                red_paths.block(next_move)
 
             # if there are no remaining open tiles, the game is a draw
             # (this means there's a bug somewhere)
-            if not get_open_tiles(rows, cols, red_moves, blue_moves) and not game_over:
+            if not game_over and not open_cells:
                 game_over = True
                 endgame_message = "It's a draw."
 
@@ -491,7 +1537,8 @@ if __name__ == "__main__":
 
         # print final game state and declare winner
         if visual:
-            print_grid(rows, cols, red_moves, blue_moves, True)
+            print_grid(rows, cols, red_moves, blue_moves, True,
+                       all_lengths_red)
         else:
             lst = sorted(all_lengths_red.items(), key=lambda x: (x[0]))
             print("\nlength distribution of minimal winning paths remaining (Red): ")
@@ -501,9 +1548,31 @@ if __name__ == "__main__":
             print("Blue tiles: " + str(list(blue_moves)) + "\n")
         print(endgame_message)
 
+    elif count:
+        print_summary(count_path_lengths(rows, cols, cell_to_avoid, RED))
+
+    elif symmetric:
+        # the summary only needs the length distributions, so the orbits
+        # are never expanded
+        family = find_paths_bitmask(rows, cols, cell_to_avoid, RED, True,
+                                    workers, cache, symmetric=True,
+                                    as_masks=True, pruning=pruning,
+                                    stats=stats)
+        print_summary(family)
+
+    elif workers > 1 or cache is not None:
+        family = find_paths(rows, cols, cell_to_avoid, RED, True, bitmask,
+                            workers, cache, pruning=pruning, stats=stats)
+        print_summary(family)
+
     else:
-        compute_paths(rows, cols, cell_to_avoid, RED, True)
-        print_summary(all_lengths_red, lengths_avoiding_cell_red)
+        # the paths are streamed, so memory does not grow with their number
+        print_summary(summarize_paths(rows, cols, cell_to_avoid, RED,
+                                      pruning, stats))
+
+    if stats:
+        print("search nodes expanded: " + str(stats['expanded'])
+              + ", pruned: " + str(stats['pruned']) + "\n")
 
     exit(0)
 
@@ -0,0 +1,274 @@
+"""
+A Monte Carlo tree search move engine for Hex with a wall-clock budget.
+
+The search grows a tree of positions from the current one until its time
+is up and then plays the most visited move. Each iteration descends the
+tree, picking children by UCT plus a progressive bias towards moves the
+Erdos-Selfridge potential favours. It then adds one child and plays the
+rest of the game out at random. Since Hex has no draws, the playout just
+fills in every open cell (the players alternating) and checks who
+connects. The tree is kept between moves: playing a move makes its
+subtree the new root.
+
+Random playouts say little about tactical positions, where a single
+precise line wins: every move can look about equally good. So, as in
+MCTS-Solver, results that are certain are propagated up the tree, and a
+proven win is played as soon as it is found. On puzzle 6 this finds the
+only winning move within about 5 seconds; on boards too large to prove
+anything in the budget the search can still miss such moves.
+"""
+import math
+import random
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+
+from hex import BLUE, RED, flood, get_board
+from potential import PotentialTracker
+
+EXPLORATION = 0.7  # weight of the UCT exploration term
+PRIOR_WEIGHT = 1.0  # weight of the potential prior, fading with visits
+PRIOR_DEPTH = 2  # nodes this deep or deeper get no prior
+
+
+class Node:
+    '''
+    A position in the search tree, reached by player playing move. untried
+    holds the moves that have no child yet, the most promising last, and
+    priors their prior scores. winner is set once the position is proven
+    won for a player: it is over, or (as in MCTS-Solver) the player to
+    move has a proven winning move, or every move is proven lost.
+    '''
+    __slots__ = ('move', 'player', 'parent', 'depth', 'children', 'untried',
+                 'priors', 'prior', 'visits', 'wins', 'winner')
+
+    def __init__(self, move: Optional[Tuple[int, int]], player: bool,
+                 parent: 'Node' = None, prior: float = 0.0) -> None:
+        self.move = move
+        self.player = player
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.children = []
+        self.untried: List[Tuple[int, int]] = []
+        self.priors = {}
+        self.prior = prior
+        self.visits = 0
+        self.wins = 0
+        self.winner = None
+
+    def select(self) -> 'Node':
+        ''' Pick a child by UCT, passing over the ones proven lost. '''
+        log_visits = math.log(self.visits)
+        children = [c for c in self.children if c.winner != self.player] \
+            or self.children
+        return max(children, key=lambda c: (
+            c.wins / c.visits
+            + EXPLORATION * math.sqrt(log_visits / c.visits)
+            + PRIOR_WEIGHT * c.prior / (c.visits + 1)))
+
+
+class MCTS:
+    '''
+    A search tree for the game on a rows x cols grid with the given stones,
+    turn being the player to move. If the players' winning paths are given
+    (lists of sets of cells, e.g. from find_paths), moves are biased towards
+    those that raise the mover's potential and cut the opponent's the
+    most, as in compute_optimal_move; otherwise all moves start out equal.
+    Updating the potentials is costly on large boards, so they only follow
+    the root position, and only nodes less than PRIOR_DEPTH moves from the
+    root get priors.
+    '''
+    def __init__(self, rows: int, cols: int, red_moves: Set[Tuple[int, int]],
+                 blue_moves: Set[Tuple[int, int]], turn: bool,
+                 red_paths: Iterable[Set[Tuple[int, int]]] = None,
+                 blue_paths: Iterable[Set[Tuple[int, int]]] = None,
+                 seed: int = None) -> None:
+        self.board = get_board(rows, cols)
+        self.random = random.Random(seed)
+        self.masks = {RED: 0, BLUE: 0}
+        for player, moves in ((RED, red_moves), (BLUE, blue_moves)):
+            for cell in moves:
+                self.masks[player] |= 1 << self.board.index[cell]
+        self.trackers = None
+        if red_paths is not None and blue_paths is not None:
+            self.trackers = {
+                RED: PotentialTracker(red_paths, claimed=red_moves,
+                                      blocked=blue_moves),
+                BLUE: PotentialTracker(blue_paths, claimed=blue_moves,
+                                       blocked=red_moves)}
+        self.root = self.new_node(None, not turn, None)
+        self.iterations = 0
+
+    def open_mask(self) -> int:
+        full = (1 << len(self.board.cells)) - 1
+        return full & ~(self.masks[RED] | self.masks[BLUE])
+
+    def has_won(self, player: bool) -> bool:
+        board = self.board
+        start, goal = board.edges(player)
+        mask = self.masks[player]
+        return bool(flood(mask & start, mask, board.cols, board.has_left,
+                          board.has_right, goal) & goal)
+
+    def apply(self, move: Tuple[int, int], player: bool) -> None:
+        self.masks[player] |= 1 << self.board.index[move]
+
+    def undo(self, move: Tuple[int, int], player: bool) -> None:
+        self.masks[player] &= ~(1 << self.board.index[move])
+
+    def scores(self, node: Node, moves: List[Tuple[int, int]]):
+        '''
+        Score the moves of the player to move after node by the potential
+        they add to their own paths plus the potential they take from the
+        opponent's paths.
+        '''
+        line = []
+        while node.parent is not None:
+            line.append(node)
+            node = node.parent
+        for n in reversed(line):
+            self.trackers[n.player].claim(n.move)
+            self.trackers[not n.player].block(n.move)
+        to_move = not (line[0].player if line else node.player)
+        own, other = self.trackers[to_move], self.trackers[not to_move]
+        scores = {m: own.gain(m) + other.gain(m) for m in moves}
+        for n in line:
+            self.trackers[n.player].unclaim(n.move)
+            self.trackers[not n.player].unblock(n.move)
+        return scores
+
+    def new_node(self, move: Optional[Tuple[int, int]], player: bool,
+                 parent: Optional[Node]) -> Node:
+        ''' Create the node of the current position, reached by move. '''
+        prior = parent.priors.get(move, 0.0) if parent is not None else 0.0
+        node = Node(move, player, parent, prior)
+        if move is not None and self.has_won(player):
+            node.winner = player
+            return node
+
+        cells = self.board.cells
+        open_mask = self.open_mask()
+        moves = [cells[i] for i in range(len(cells)) if open_mask >> i & 1]
+        if self.trackers is not None and node.depth < PRIOR_DEPTH:
+            scores = self.scores(node, moves)
+            best = max(scores.values(), default=0.0)
+            if best > 0:
+                node.priors = {m: s / best for m, s in scores.items()}
+        self.random.shuffle(moves)  # ties are broken at random
+        node.untried = sorted(moves, key=lambda m: node.priors.get(m, 0.0))
+        return node
+
+    def playout(self, to_move: bool) -> bool:
+        ''' Fill the open cells at random, and return who connects. '''
+        board = self.board
+        open_mask = self.open_mask()
+        open_cells = [i for i in range(len(board.cells)) if open_mask >> i & 1]
+        self.random.shuffle(open_cells)
+        mine = 0  # the to_move player moves first, so gets the odd one out
+        for i in open_cells[::2]:
+            mine |= 1 << i
+        if to_move == RED:
+            red = self.masks[RED] | mine
+        else:
+            red = self.masks[RED] | (open_mask & ~mine)
+        start, goal = board.first_row, board.last_row
+        connected = flood(red & start, red, board.cols, board.has_left,
+                          board.has_right, goal) & goal
+        return RED if connected else BLUE
+
+    def iterate(self) -> None:
+        node = self.root
+        played = []
+
+        # selection
+        while node.winner is None and not node.untried and node.children:
+            node = node.select()
+            self.apply(node.move, node.player)
+            played.append(node)
+
+        # expansion
+        if node.winner is None and node.untried:
+            move = node.untried.pop()
+            self.apply(move, not node.player)
+            child = self.new_node(move, not node.player, node)
+            node.children.append(child)
+            node = child
+            played.append(node)
+
+        # simulation
+        winner = node.winner
+        if winner is None:
+            winner = self.playout(not node.player)
+
+        # backpropagation
+        self.prove(node)
+        while node is not None:
+            node.visits += 1
+            if node.player == winner:
+                node.wins += 1
+            node = node.parent
+        for node in reversed(played):
+            self.undo(node.move, node.player)
+        self.iterations += 1
+
+    def prove(self, node: Node) -> None:
+        '''
+        Mark the ancestors of node as proven, as far as node being proven
+        decides them.
+        '''
+        while node.winner is not None and node.parent is not None:
+            parent = node.parent
+            if node.winner == node.player:  # a winning move
+                parent.winner = node.player
+            elif not parent.untried and all(c.winner == parent.player
+                                            for c in parent.children):
+                parent.winner = parent.player
+            else:
+                return
+            node = parent
+
+    def best_move(self, seconds: float) -> Tuple[Tuple[int, int], float]:
+        '''
+        Search for seconds (at least one iteration, and no longer once the
+        root is proven), and return a proven winning move if there is one,
+        and otherwise the most visited move not proven lost. The move comes
+        with the share of its playouts the mover won, or 1 or 0 if it is
+        proven won or lost.
+        '''
+        deadline = time.perf_counter() + seconds
+        self.iterate()
+        while self.root.winner is None and time.perf_counter() < deadline:
+            self.iterate()
+        if not self.root.children:
+            raise ValueError('the game is over')
+        mover = not self.root.player
+        best = max(self.root.children, key=lambda c: (
+            c.winner == mover, c.winner != self.root.player, c.visits))
+        if best.winner is not None:
+            return best.move, float(best.winner == mover)
+        return best.move, best.wins / best.visits
+
+    def play(self, move: Tuple[int, int]) -> None:
+        '''
+        Make move (by the player to move) in the root position, keeping
+        the subtree below it.
+        '''
+        player = not self.root.player
+        self.apply(move, player)
+        if self.trackers is not None:
+            self.trackers[player].claim(move)
+            self.trackers[not player].block(move)
+        for child in self.root.children:
+            if child.move == move:
+                child.parent = None
+                self.root = child
+                self.reroot(child)
+                return
+        self.root = self.new_node(move, player, None)
+
+    def reroot(self, node: Node) -> None:
+        ''' Renumber the depths below node, now the root. '''
+        stack = [(node, 0)]
+        while stack:
+            n, depth = stack.pop()
+            n.depth = depth
+            stack.extend((c, depth + 1) for c in n.children)
@@ -0,0 +1,195 @@
+"""
+Monte Carlo estimates of win probabilities under random play, for
+comparison with the potential strategy of compute_optimal_move.
+
+Two kinds of random play are simulated. In random-turn Hex (Peres et al.)
+a coin flip decides who places the next stone; in plain random play the
+players alternate. Both place their stones on uniformly random open cells.
+A game of Hex cannot end in a draw, and filling in the rest of the grid
+after someone has connected their edges does not change who connected
+them. So a game is played out by colouring every open cell at once and
+checking who connects. Under random-turn play every open cell gets a fair
+coin; under alternating play a random half of the cells goes to each
+player. Many games are coloured and flood-filled together as NumPy
+arrays, and the games are split across a pool of processes.
+
+ex: python monte_carlo.py 9 --games 20000 --mode random-turn
+"""
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Set, Tuple
+
+from hex import BLUE, RED, compute_optimal_move, find_paths, get_board
+from polygon_puzzles import puzzles
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MODES = ['random-turn', 'random']
+BATCH_SIZE = 4096  # games flood-filled at once
+Z_95 = 1.959964  # for 95% confidence intervals
+
+
+def wins_for_moves(rows: int, cols: int, red_moves: Set[Tuple[int, int]],
+                   blue_moves: Set[Tuple[int, int]], player: bool,
+                   games: int, mode: str, seed) -> List[int]:
+    '''
+    For every open cell (in the order of get_open_tiles), play games random
+    games after player takes that cell, and return the number of them
+    player wins.
+    '''
+    if np is None:
+        raise ImportError("numpy is required for the Monte Carlo simulator")
+    board = get_board(rows, cols)
+    rng = np.random.default_rng(seed)
+    size = rows * cols
+    own = red_moves if player == RED else blue_moves
+    open_tiles = board.open_tiles(red_moves, blue_moves)
+
+    # neighbour indices padded with size, a column that is never reached
+    neighbours = np.full((size, 6), size, dtype=np.intp)
+    for i, lst in enumerate(board.neighbours):
+        neighbours[i, :len(lst)] = lst
+    start, goal = (np.array([mask >> i & 1 for i in range(size)], dtype=bool)
+                   for mask in board.edges(player))
+
+    fixed = np.zeros(size + 1, dtype=bool)
+    fixed[[board.index[cell] for cell in own]] = True
+    wins = []
+    for move in open_tiles:
+        rest = np.array([board.index[t] for t in open_tiles if t != move],
+                        dtype=np.intp)
+        # under alternating play the opponent moves next
+        share = np.zeros(len(rest), dtype=bool)
+        share[:len(rest) // 2] = True
+        won = 0
+        for done in range(0, games, BATCH_SIZE):
+            batch = min(BATCH_SIZE, games - done)
+            owned = np.tile(fixed, (batch, 1))
+            owned[:, board.index[move]] = True
+            if mode == 'random-turn':
+                owned[:, rest] = rng.random((batch, len(rest))) < 0.5
+            else:
+                owned[:, rest] = rng.permuted(np.tile(share, (batch, 1)),
+                                              axis=1)
+            won += int(connects(owned, neighbours, start, goal).sum())
+        wins.append(won)
+    return wins
+
+
+def connects(owned, neighbours, start, goal):
+    '''
+    Return, for every row of owned (a games x (cells + 1) boolean array
+    whose last column is False), whether its cells connect start to goal.
+    '''
+    size = len(start)
+    reached = np.zeros_like(owned)
+    reached[:, :size] = owned[:, :size] & start
+    while True:
+        grown = reached[:, :size] | (owned[:, :size]
+                                     & reached[:, neighbours].any(axis=2))
+        if np.array_equal(grown, reached[:, :size]):
+            break
+        reached[:, :size] = grown
+    return (reached[:, :size] & goal).any(axis=1)
+
+
+def wilson_interval(wins: int, games: int) -> Tuple[float, float]:
+    ''' Return the 95% Wilson score interval of a win probability. '''
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    centre = (p + Z_95**2 / (2 * games)) / (1 + Z_95**2 / games)
+    spread = Z_95 * math.sqrt(p * (1 - p) / games
+                              + Z_95**2 / (4 * games**2)) \
+             / (1 + Z_95**2 / games)
+    return max(centre - spread, 0.0), min(centre + spread, 1.0)
+
+
+def estimate_win_probabilities(rows: int, cols: int,
+                               red_moves: Set[Tuple[int, int]],
+                               blue_moves: Set[Tuple[int, int]],
+                               player: bool, games: int,
+                               mode: str = 'random-turn', workers: int = 1,
+                               seed: int = None) -> Dict[Tuple[int, int], Dict]:
+    '''
+    Estimate, for every open cell, the probability that player wins by
+    taking it and then playing on randomly (see MODES), from games games
+    per cell split across workers processes. Return, for every cell, its
+    number of wins and games, the estimate and its 95% confidence
+    interval.
+    '''
+    if np is None:
+        raise ImportError("numpy is required for the Monte Carlo simulator")
+    open_tiles = get_board(rows, cols).open_tiles(red_moves, blue_moves)
+    workers = max(1, min(workers, games))
+    chunks = [games // workers + (i < games % workers) for i in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    args = [(rows, cols, red_moves, blue_moves, player, chunk, mode, s)
+            for chunk, s in zip(chunks, seeds)]
+
+    if workers == 1:
+        results = [wins_for_moves(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(wins_for_moves, *zip(*args)))
+
+    estimates = {}
+    for i, cell in enumerate(open_tiles):
+        wins = sum(result[i] for result in results)
+        low, high = wilson_interval(wins, games)
+        estimates[cell] = {'wins': wins, 'games': games,
+                           'probability': wins / games, 'low': low,
+                           'high': high}
+    return estimates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('puzzle_number', type=int, help='the puzzle ID number')
+    parser.add_argument('--games', type=int, default=10000,
+                        help='random games per candidate move')
+    parser.add_argument('--mode', choices=MODES, default='random-turn',
+                        help='who moves after the candidate move: a coin '
+                             'flip (random-turn) or the players in turn')
+    parser.add_argument('--player', choices=['red', 'blue'], default='blue',
+                        help='the player to move')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for reproducible estimates')
+    args = parser.parse_args()
+    if args.puzzle_number not in puzzles:
+        parser.error('unknown puzzle number: ' + str(args.puzzle_number))
+
+    rows, cols, red_cells, blue_cells = puzzles[args.puzzle_number]
+    player = RED if args.player == 'red' else BLUE
+    start = time.perf_counter()
+    estimates = estimate_win_probabilities(rows, cols, set(red_cells),
+                                           set(blue_cells), player,
+                                           args.games, args.mode,
+                                           args.workers, args.seed)
+    seconds = time.perf_counter() - start
+
+    # the potential strategy's move, to compare against
+    red_paths = find_paths(rows, cols, blue_cells, RED, False).paths
+    blue_paths = find_paths(rows, cols, red_cells, BLUE, False).paths
+    potential_move, _ = compute_optimal_move(rows, cols, set(red_cells),
+                                             set(blue_cells), red_paths,
+                                             blue_paths, player, 'tracker')
+
+    print("win probability of " + args.player + " after each move ("
+          + args.mode + " play, " + str(args.games) + " games per move):")
+    ranked = sorted(estimates.items(), key=lambda item: -item[1]['wins'])
+    for rank, (cell, e) in enumerate(ranked, 1):
+        print("%3d. %-8s %.4f  [%.4f, %.4f]%s" % (
+            rank, str(cell), e['probability'], e['low'], e['high'],
+            "  <- potential strategy" if cell == potential_move else ""))
+    total = args.games * len(estimates)
+    print("\n" + str(total) + " games in %.2f s (%.0f games per second)"
+          % (seconds, total / seconds if seconds else 0))
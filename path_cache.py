@@ -0,0 +1,175 @@
+"""
+On-disk cache of the path bitmasks found by find_paths_bitmask.
+
+Every search is stored in its own file: a fixed header, the two length
+distributions and then the path bitmasks as little-endian 64-bit words,
+so loading an entry is a memory-map. Files written with a different
+CACHE_VERSION are ignored and removed, and once the cache directory
+outgrows max_bytes the least recently used files are deleted.
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+CACHE_VERSION = 1
+MAGIC = b'HXPC'
+# magic, version, rows, cols, returning_all, avoiding, # of paths,
+# # of entries in all_lengths, # of entries in lengths_avoiding_cell
+HEADER = struct.Struct('<4sHHHBBQII')
+LENGTH_ENTRY = struct.Struct('<IQ')
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'hex_paths')
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+Entry = Tuple[List[int], Dict[int, int], Dict[int, int]]
+
+
+class PathCache:
+    '''
+    A directory of cached searches. An entry is identified by the grid
+    size, the bitmask of the cells to avoid (in the searched grid, which
+    is transposed for Blue), whether any cells were given to avoid,
+    returning_all and whether only one path per symmetry orbit was kept
+    (see find_paths_bitmask). The player is not part of the key: the
+    bitmasks are the same for both, only their conversion to coordinates
+    differs.
+    '''
+    def __init__(self, directory: str = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        if directory is None:
+            directory = os.environ.get('HEX_PATH_CACHE', DEFAULT_CACHE_DIR)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def filename(self, rows: int, cols: int, avoid_mask: int, avoiding: bool,
+                 returning_all: bool, symmetric: bool) -> str:
+        name = '%dx%d-%x-%d-%d%s.paths' % (rows, cols, avoid_mask, avoiding,
+                                           returning_all,
+                                           '-orbits' if symmetric else '')
+        return os.path.join(self.directory, name)
+
+    def get(self, rows: int, cols: int, avoid_mask: int, avoiding: bool,
+            returning_all: bool, symmetric: bool) -> Optional[Entry]:
+        '''
+        Return the path bitmasks and the two length distributions of a
+        cached search, or None if it is not in the cache.
+        '''
+        filename = self.filename(rows, cols, avoid_mask, avoiding,
+                                 returning_all, symmetric)
+        try:
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    entry = read_entry(data, rows, cols, avoiding,
+                                       returning_all)
+            if entry is None:
+                os.remove(filename)  # written by another version
+            else:
+                os.utime(filename)  # mark as recently used
+        except (OSError, ValueError, struct.error):
+            return None
+        return entry
+
+    def put(self, rows: int, cols: int, avoid_mask: int, avoiding: bool,
+            returning_all: bool, symmetric: bool, masks: List[int],
+            all_lengths: Dict[int, int],
+            lengths_avoiding_cell: Dict[int, int]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.filename(rows, cols, avoid_mask, avoiding,
+                                 returning_all, symmetric)
+
+        # write to a temporary file first so readers never see half an entry
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_entry(f, rows, cols, avoiding, returning_all, masks,
+                            all_lengths, lengths_avoiding_cell)
+            os.replace(temp_name, filename)
+        except OSError:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        ''' Delete the least recently used entries above max_bytes. '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.paths'):
+                filename = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+
+def words_per_path(rows: int, cols: int) -> int:
+    return (rows * cols + 63) // 64
+
+
+def write_entry(f, rows: int, cols: int, avoiding: bool, returning_all: bool,
+                masks: List[int], all_lengths: Dict[int, int],
+                lengths_avoiding_cell: Dict[int, int]) -> None:
+    f.write(HEADER.pack(MAGIC, CACHE_VERSION, rows, cols, returning_all,
+                        avoiding, len(masks), len(all_lengths),
+                        len(lengths_avoiding_cell)))
+    size = HEADER.size
+    for distr in (all_lengths, lengths_avoiding_cell):
+        for length, count in sorted(distr.items()):
+            f.write(LENGTH_ENTRY.pack(length, count))
+            size += LENGTH_ENTRY.size
+    f.write(bytes(-size % 8))  # align the bitmasks
+
+    size = 8 * words_per_path(rows, cols)
+    for mask in masks:
+        f.write(mask.to_bytes(size, 'little'))
+
+
+def read_entry(data, rows: int, cols: int, avoiding: bool,
+               returning_all: bool) -> Optional[Entry]:
+    magic, version, entry_rows, entry_cols, entry_returning_all, \
+        entry_avoiding, num_paths, num_lengths, num_avoiding_lengths \
+        = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != CACHE_VERSION:
+        return None
+    if (entry_rows, entry_cols, entry_returning_all, entry_avoiding) != \
+            (rows, cols, returning_all, avoiding):
+        return None
+
+    offset = HEADER.size
+    distrs = []
+    for num_entries in (num_lengths, num_avoiding_lengths):
+        distr = {}
+        for _ in range(num_entries):
+            length, count = LENGTH_ENTRY.unpack_from(data, offset)
+            distr[length] = count
+            offset += LENGTH_ENTRY.size
+        distrs.append(distr)
+    offset += -offset % 8
+
+    size = 8 * words_per_path(rows, cols)
+    end = offset + size * num_paths
+    if len(data) < end:
+        raise ValueError('truncated path cache entry')
+    if size == 8 and sys.byteorder == 'little':
+        packed = array('Q')
+        with memoryview(data) as view:
+            packed.frombytes(view[offset:end])
+        masks = packed.tolist()
+    else:
+        masks = [int.from_bytes(data[i:i + size], 'little')
+                 for i in range(offset, end, size)]
+    return masks, distrs[0], distrs[1]
@@ -0,0 +1,61 @@
+"""
+A family of winning paths indexed by cell, for removing the paths through
+a cell without a pass over the whole family.
+"""
+from typing import Dict, Hashable, Iterable, Iterator, List, Set
+
+
+class PathIndex:
+    '''
+    A list of paths (sets of cells) with an inverted index from every cell
+    to the ids of the paths through it, and a live flag per path. Blocking
+    a cell kills the live paths through it and touches nothing else; the
+    length distribution of the live paths is kept up to date, and blocks
+    can be undone in reverse order.
+
+    Iterating over the index yields the live paths in their original
+    order, so it can stand in for the list of remaining paths, e.g. in
+    compute_optimal_move.
+    '''
+    def __init__(self, paths: Iterable[Set[Hashable]]) -> None:
+        self.paths = list(paths)
+        self.live = bytearray(b'\x01') * len(self.paths)
+        self.num_live = len(self.paths)
+        self.paths_through: Dict[Hashable, List[int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.history: List[List[int]] = []  # the ids killed by each block
+
+        for i, path in enumerate(self.paths):
+            for cell in path:
+                self.paths_through.setdefault(cell, []).append(i)
+            self.lengths[len(path)] = self.lengths.get(len(path), 0) + 1
+
+    def block(self, cell: Hashable) -> int:
+        ''' Kill the live paths through cell, and return their number. '''
+        live = self.live
+        killed = [i for i in self.paths_through.get(cell, ()) if live[i]]
+        for i in killed:
+            live[i] = 0
+            length = len(self.paths[i])
+            self.lengths[length] -= 1
+            if not self.lengths[length]:
+                del self.lengths[length]
+        self.num_live -= len(killed)
+        self.history.append(killed)
+        return len(killed)
+
+    def undo(self) -> None:
+        ''' Revive the paths killed by the last block. '''
+        killed = self.history.pop()
+        for i in killed:
+            self.live[i] = 1
+            length = len(self.paths[i])
+            self.lengths[length] = self.lengths.get(length, 0) + 1
+        self.num_live += len(killed)
+
+    def __len__(self) -> int:
+        return self.num_live
+
+    def __iter__(self) -> Iterator[Set[Hashable]]:
+        live = self.live
+        return (path for i, path in enumerate(self.paths) if live[i])
@@ -1,6 +1,29 @@
 import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import position_cache
+import profiler
 from hex import *
 
+try:
+    import resource
+except ImportError:  # only used to report peak memory, and not on Windows
+    resource = None
+
+# Pool options giving every task a new worker process, so that the peak
+# memory reported is the task's own. max_tasks_per_child needs Python 3.11;
+# older versions reuse the workers, whose peak memory is then the largest
+# of their tasks so far.
+ONE_TASK_PER_WORKER = {'max_tasks_per_child': 1} \
+    if sys.version_info >= (3, 11) else {}
+# The largest puzzles (rows x cols) whose paths are listed one by one in
+# reasonable time; larger ones need the zdd backend.
+MAX_LISTED_CELLS = 7 * 7
+
 # Format: puzzle_number: [rows, cols,
 #                         [red cells],
 #                         [blue cells]]
@@ -138,150 +161,436 @@ puzzles = {1: [11, 11,
            }
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('puzzle_number', type=int, help='the puzzle ID number')
-parser.add_argument('--finish', action='store_true', default=False,
-                    help='finish game automatically using potential \\'
-                         ' and random strategies')
-parser.add_argument('--play', action='store_true', default=False,
-                    help='play the rest of the game manually')
-args = parser.parse_args()
-n = args.puzzle_number
-finish_game = args.finish
-play_game = args.play
-
-rows = puzzles[n][0]
-cols = puzzles[n][1]
-red_cells = puzzles[n][2]
-blue_cells = puzzles[n][3]
-red_moves = set(red_cells)
-blue_moves = set(blue_cells)
-
-red_paths = compute_paths(rows, cols, blue_cells, RED, False)
-blue_paths = compute_paths(rows, cols, red_cells, BLUE, False)
-print("red paths: " + str(red_paths))
-print("blue paths: " + str(blue_paths))
-
-print_grid(rows, cols, red_cells, blue_cells, False)
-
-# Compute optimal next move for the Blue player, plus the Erdos-Selfridge
-# potential from Blue's perspective
-next_move, potential = compute_optimal_move(rows, cols,
-                                            red_moves, blue_moves,
-                                            red_paths, blue_paths,
-                                            BLUE)
-print("Optimal next move for puzzle " + str(n) + ": " + str(next_move))
-print("Erdos-Selfridge potential for puzzle " + str(n) + " = " + str(potential))
-
-if finish_game:
+def reset_peak_memory() -> bool:
+    '''
+    Restart the peak reported by peak_memory from the current resident
+    set size, and return whether that worked. Only Linux can do this.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_memory() -> int:
+    '''
+    Return the peak resident set size of this process in bytes, since the
+    last reset_peak_memory if it worked, or 0 where neither /proc nor the
+    resource module is available.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024  # in KiB
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # KiB on Linux
+
+
+def solve_puzzle(n: int, backend: str = 'sets', cache: PathCache = None,
+                 pruning: bool = False) -> Dict:
+    '''
+    Find both players' paths for puzzle n and the optimal Blue move, and
+    return a report row: the move, its potential, the number of paths of
+    each player, and the wall time of every phase (Red's paths, Blue's
+    paths, the move) with its peak memory. Where the peak cannot be reset
+    between phases (see reset_peak_memory), only the peak of the whole
+    puzzle is reported.
+    '''
+    rows, cols, red_cells, blue_cells = puzzles[n]
+    phases = {}
+    paths = {}
+    per_phase = reset_peak_memory()
+
+    for phase, player, cells in (('red_paths', RED, blue_cells),
+                                 ('blue_paths', BLUE, red_cells)):
+        if per_phase:
+            reset_peak_memory()
+        start = time.perf_counter()
+        if backend == 'zdd':
+            paths[player] = build_path_zdd(rows, cols, cells, player)
+        else:
+            paths[player] = find_paths(rows, cols, cells, player, False,
+                                       cache=cache, pruning=pruning).paths
+        phases[phase + '_seconds'] = time.perf_counter() - start
+        if per_phase:
+            phases[phase + '_peak_bytes'] = peak_memory()
+
+    if per_phase:
+        reset_peak_memory()
+    start = time.perf_counter()
+    next_move, potential = compute_optimal_move(rows, cols,
+                                                set(red_cells),
+                                                set(blue_cells),
+                                                paths[RED], paths[BLUE],
+                                                BLUE, backend)
+    phases['move_seconds'] = time.perf_counter() - start
+    phases['move_peak_bytes' if per_phase else 'peak_bytes'] = peak_memory()
+
+    report = {'puzzle': n, 'rows': rows, 'cols': cols, 'backend': backend,
+              'move': list(next_move), 'potential': potential,
+              'red_paths': len(paths[RED]), 'blue_paths': len(paths[BLUE])}
+    report.update(phases)
+    return report
+
+
+def solve_puzzles(numbers: List[int], backend: str = 'sets',
+                  workers: int = 1, cache: PathCache = None,
+                  pruning: bool = False) -> List[Dict]:
+    '''
+    Run solve_puzzle on every puzzle in numbers across a pool of workers
+    processes, and return the report rows in puzzle order. Every puzzle
+    gets a fresh process, so that the peak memory reported is its own.
+    The largest boards are handed out first so that they do not finish
+    last on their own.
+    '''
+    order = sorted(numbers, key=lambda n: -puzzles[n][0] * puzzles[n][1])
+    with ProcessPoolExecutor(max_workers=workers,
+                             **ONE_TASK_PER_WORKER) as executor:
+        reports = list(executor.map(solve_puzzle, order,
+                                    [backend] * len(order),
+                                    [cache] * len(order),
+                                    [pruning] * len(order)))
+    return sorted(reports, key=lambda report: report['puzzle'])
+
+
+@profiler.timed('finish_game_randomly')
+def finish_game_randomly(rows: int, cols: int,
+                         red_moves: Set[Tuple[int, int]],
+                         blue_moves: Set[Tuple[int, int]],
+                         red_paths, blue_paths, backend: str = 'sets',
+                         show: bool = True, engine: str = 'potential',
+                         budget: float = 1.0) -> int:
+    '''
+    Play the game out from the given position, Blue using the potential
+    strategy (or, if engine is 'mcts', a tree search of budget seconds per
+    move) and Red playing randomly, and return the number of moves played.
+    The moves are added to red_moves and blue_moves, and the grid is
+    printed after every move if show is set. Lists of paths are left
+    unchanged: the game works on a PathIndex of them (see index_paths).
+    '''
+    board = get_board(rows, cols)
+    open_cells = board.open_cells(red_moves, blue_moves)
+    connectivity = board.connectivity(red_moves, blue_moves)
+    search = None
+    if engine == 'mcts':
+        from mcts import MCTS
+        search = MCTS(rows, cols, red_moves, blue_moves, BLUE, red_paths,
+                      blue_paths)
+    red_tracker = None
+    if search is None and backend == 'tracker':
+        # Red's potential, kept up to date as stones are placed instead of
+        # being rebuilt for every Blue move
+        red_tracker = PotentialTracker(red_paths, claimed=red_moves,
+                                       blocked=blue_moves)
+    red_paths = index_paths(red_paths)
+    blue_paths = index_paths(blue_paths)
+    num_moves = 0
     game_over = False
     while not game_over:
-        print_grid(rows, cols, red_moves, blue_moves, False)
+        if show:
+            print_grid(rows, cols, red_moves, blue_moves, False)
 
         # Blue uses potential strategy
-        next_move, potential = compute_optimal_move(rows, cols,
-                                                    red_moves, blue_moves,
-                                                    red_paths, blue_paths,
-                                                    BLUE)
+        if search is not None:
+            next_move, _ = search.best_move(budget)
+            search.play(next_move)
+        elif red_tracker is not None:
+            next_move, _ = compute_optimal_move_tracked(red_tracker,
+                                                        open_cells.tiles())
+        else:
+            next_move, potential = compute_optimal_move(rows, cols,
+                                                        red_moves, blue_moves,
+                                                        red_paths, blue_paths,
+                                                        BLUE, backend,
+                                                        open_cells.tiles())
         blue_moves.add(next_move)
-        for path in blue_paths: # check win condition
-            if path.issubset(blue_moves):
-                game_over = True
-                break
+        open_cells.take(next_move)
+        if red_tracker is not None:
+            red_tracker.block(next_move)
+        num_moves += 1
+        # check win condition
+        game_over = connectivity.add(next_move, BLUE)
 
         if not game_over:
-            print_grid(rows, cols, red_moves, blue_moves, False)
+            if show:
+                print_grid(rows, cols, red_moves, blue_moves, False)
             # remove Red paths containing last Blue move
-            new_red_paths = [p for p in red_paths if next_move not in p]
-            red_paths = new_red_paths
+            red_paths = remove_paths_through(red_paths, next_move)
 
             # Red plays randomly
-            open_tiles = get_open_tiles(rows, cols, red_moves, blue_moves)
+            open_tiles = open_cells.tiles()
             next_move = open_tiles[random.randint(0, len(open_tiles)-1)]
             red_moves.add(next_move)
-            for path in red_paths: # check win condition
-                if path.issubset(red_moves):
-                    game_over = True
-                    break
-            # remove Blue paths containing last Red move
-            new_blue_paths = [p for p in blue_paths if next_move not in p]
-            blue_paths = new_blue_paths
-
-    print_grid(rows, cols, red_moves, blue_moves, False)
-    exit(0)
+            open_cells.take(next_move)
+            if red_tracker is not None:
+                red_tracker.claim(next_move)
+            num_moves += 1
+            # check win condition
+            game_over = connectivity.add(next_move, RED)
+            if not game_over:
+                if search is not None:
+                    search.play(next_move)
+                # remove Blue paths containing last Red move
+                blue_paths = remove_paths_through(blue_paths, next_move)
 
-if play_game:
-    player = BLUE
-    game_over = False
-    while not game_over:
+    if show:
         print_grid(rows, cols, red_moves, blue_moves, False)
-        if player == RED:
-            print('Red\'s turn')
-        else:  # player == BLUE
-            print('Blue\'s turn')
-        red_potential = compute_potential(red_paths, red_moves)
-        blue_potential = compute_potential(blue_paths, blue_moves)
-        print('Red potential = ' + str(red_potential))
-        print('Blue potential = ' + str(blue_potential))
-
-        # Compute the optimal next move for the Blue player,
-        # plus the Erdos-Selfridge potential from Blue's perspective
-        if player == RED:
-            next_move, potential = compute_optimal_move(rows, cols,
-                                                        red_moves,
-                                                        blue_moves,
-                                                        red_paths,
-                                                        blue_paths,
-                                                        RED)
-
-        elif player == BLUE:
-            # Compute a move that minimizes the potential Red can reach
-            # after selecting their next move.
-            next_move, potential = compute_optimal_move(rows, cols,
-                                                        red_moves,
-                                                        blue_moves,
-                                                        red_paths,
-                                                        blue_paths,
-                                                        BLUE)
-        print("Optimal next move: " + str(next_move))
-        print("Erdos-Selfridge potential = " + str(potential))
-
-        x, y = (int(c.strip("()[] ")) for c in
-                input("Please enter x,y coordinates: ").split(','))
-        next_move = (x, y)
-
-        if player == RED:
-            red_moves.add(next_move)
+    return num_moves
 
-            # check win condition
-            for path in red_paths:
-                if path.issubset(red_moves):
+
+def write_report(reports: List[Dict], filename: str = None) -> None:
+    '''
+    Write report rows as CSV if filename ends in .csv, and as JSON
+    otherwise. Without a filename, the JSON goes to standard output.
+    '''
+    if filename and filename.endswith('.csv'):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(reports[0]) if reports
+                                    else ['puzzle'])
+            writer.writeheader()
+            writer.writerows(reports)
+    elif filename:
+        with open(filename, 'w') as f:
+            json.dump(reports, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('puzzle_number', type=int, nargs='*',
+                        help='the puzzle ID number (any number of them with '
+                             '--batch; by default all puzzles the backend can '
+                             'handle)')
+    parser.add_argument('--finish', action='store_true', default=False,
+                        help='finish game automatically using potential \\'
+                             ' and random strategies')
+    parser.add_argument('--play', action='store_true', default=False,
+                        help='play the rest of the game manually')
+    parser.add_argument('--backend', choices=BACKENDS, default='sets',
+                        help='how compute_optimal_move evaluates moves; with '
+                             '--finish and --play, tracker keeps the '
+                             'potentials up to date itself instead of '
+                             'calling compute_optimal_move after the first '
+                             'move')
+    parser.add_argument('--engine', choices=ENGINES, default='potential',
+                        help='how Blue picks its moves with --finish, and '
+                             'the moves suggested with --play: the potential '
+                             'strategy or a Monte Carlo tree search')
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='seconds of tree search per move with '
+                             '--engine mcts')
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help='keep computed paths in the on-disk path cache')
+    parser.add_argument('--prune', action='store_true', default=False,
+                        help='prune dead ends of the path search and report '
+                             'the number of search nodes')
+    parser.add_argument('--batch', action='store_true', default=False,
+                        help='solve the puzzles across a process pool and '
+                             'report the results')
+    parser.add_argument('--report', type=str, default=None,
+                        help='file for the batch report (.json or .csv), '
+                             'standard output by default')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes for --batch')
+    parser.add_argument('--position-cache', action='store_true',
+                        default=False,
+                        help='remember the potential strategy\'s move for '
+                             'every position (up to symmetry) seen in this '
+                             'run (not the moves --finish and --play make '
+                             'with --backend tracker)')
+    parser.add_argument('--position-cache-file', type=str, default=None,
+                        help='file to load the position cache from and save '
+                             'it to at exit (implies --position-cache)')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='print where the time went at exit (not '
+                             'counting the --batch worker processes)')
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
+    if args.position_cache or args.position_cache_file:
+        position_cache.enable(filename=args.position_cache_file)
+    finish_game = args.finish
+    play_game = args.play
+    backend = args.backend
+    engine = args.engine
+    budget = args.budget
+    cache = PathCache() if args.cache else None
+    pruning = args.prune
+
+    if args.batch:
+        numbers = args.puzzle_number or sorted(puzzles)
+        if not set(numbers) <= set(puzzles):
+            parser.error('unknown puzzle number(s): ' + str(
+                sorted(set(numbers) - set(puzzles))))
+        too_large = [] if backend == 'zdd' else [
+            n for n in numbers
+            if puzzles[n][0] * puzzles[n][1] > MAX_LISTED_CELLS]
+        if too_large and args.puzzle_number:
+            parser.error('puzzle(s) ' + str(too_large) + ' are too large to '
+                         'list their paths; use --backend zdd')
+        if too_large:
+            print('skipping puzzle(s) ' + str(too_large) + ', too large to '
+                  'list their paths (use --backend zdd)', file=sys.stderr)
+            numbers = [n for n in numbers if n not in too_large]
+        write_report(solve_puzzles(numbers, backend, args.workers, cache, pruning),
+                     args.report)
+        exit(0)
+    if len(args.puzzle_number) != 1:
+        parser.error('expected one puzzle number without --batch')
+    n = args.puzzle_number[0]
+
+    rows = puzzles[n][0]
+    cols = puzzles[n][1]
+    red_cells = puzzles[n][2]
+    blue_cells = puzzles[n][3]
+    red_moves = set(red_cells)
+    blue_moves = set(blue_cells)
+
+    if backend == 'zdd':
+        red_paths = build_path_zdd(rows, cols, blue_cells, RED)
+        blue_paths = build_path_zdd(rows, cols, red_cells, BLUE)
+    else:
+        stats = {} if pruning else None
+        red_paths = find_paths(rows, cols, blue_cells, RED, False, cache=cache,
+                               pruning=pruning, stats=stats).paths
+        blue_paths = find_paths(rows, cols, red_cells, BLUE, False, cache=cache,
+                                pruning=pruning, stats=stats).paths
+        if stats:
+            print("search nodes expanded: " + str(stats['expanded'])
+                  + ", pruned: " + str(stats['pruned']))
+    print("red paths: " + str(red_paths))
+    print("blue paths: " + str(blue_paths))
+
+    print_grid(rows, cols, red_cells, blue_cells, False)
+
+    # Compute optimal next move for the Blue player, plus the Erdos-Selfridge
+    # potential from Blue's perspective
+    next_move, potential = compute_optimal_move(rows, cols,
+                                                red_moves, blue_moves,
+                                                red_paths, blue_paths,
+                                                BLUE, backend)
+    print("Optimal next move for puzzle " + str(n) + ": " + str(next_move))
+    print("Erdos-Selfridge potential for puzzle " + str(n) + " = " + str(potential))
+
+    if finish_game:
+        finish_game_randomly(rows, cols, red_moves, blue_moves, red_paths,
+                             blue_paths, backend, engine=engine,
+                             budget=budget)
+        exit(0)
+
+    if play_game:
+        connectivity = get_board(rows, cols).connectivity(red_moves,
+                                                          blue_moves)
+        search = None
+        if engine == 'mcts':
+            from mcts import MCTS
+            search = MCTS(rows, cols, red_moves, blue_moves, BLUE, red_paths,
+                          blue_paths)
+        trackers = None
+        if search is None and backend == 'tracker':
+            # both players' potentials, kept up to date as stones are
+            # placed instead of being rebuilt for every move
+            trackers = {
+                RED: PotentialTracker(red_paths, claimed=red_moves,
+                                      blocked=blue_moves),
+                BLUE: PotentialTracker(blue_paths, claimed=blue_moves,
+                                       blocked=red_moves)}
+        red_paths = index_paths(red_paths)
+        blue_paths = index_paths(blue_paths)
+        player = BLUE
+        game_over = False
+        while not game_over:
+            print_grid(rows, cols, red_moves, blue_moves, False)
+            if player == RED:
+                print('Red\'s turn')
+            else:  # player == BLUE
+                print('Blue\'s turn')
+            red_potential = compute_potential(red_paths, red_moves)
+            blue_potential = compute_potential(blue_paths, blue_moves)
+            print('Red potential = ' + str(red_potential))
+            print('Blue potential = ' + str(blue_potential))
+
+            # Compute the optimal next move for the Blue player,
+            # plus the Erdos-Selfridge potential from Blue's perspective
+            if search is not None:
+                next_move, win_rate = search.best_move(budget)
+                print("Tree search move: " + str(next_move)
+                      + " (%.0f%% of its playouts won)" % (100 * win_rate))
+
+            elif trackers is not None:
+                # the move the opponent's potential gains the most from
+                next_move, potential = compute_optimal_move_tracked(
+                    trackers[not player],
+                    get_open_tiles(rows, cols, red_moves, blue_moves))
+
+            elif player == RED:
+                next_move, potential = compute_optimal_move(rows, cols,
+                                                            red_moves,
+                                                            blue_moves,
+                                                            red_paths,
+                                                            blue_paths,
+                                                            RED, backend)
+
+            elif player == BLUE:
+                # Compute a move that minimizes the potential Red can reach
+                # after selecting their next move.
+                next_move, potential = compute_optimal_move(rows, cols,
+                                                            red_moves,
+                                                            blue_moves,
+                                                            red_paths,
+                                                            blue_paths,
+                                                            BLUE, backend)
+            if search is None:
+                print("Optimal next move: " + str(next_move))
+                print("Erdos-Selfridge potential = " + str(potential))
+
+            x, y = (int(c.strip("()[] ")) for c in
+                    input("Please enter x,y coordinates: ").split(','))
+            next_move = (x, y)
+            if search is not None:
+                search.play(next_move)
+            if trackers is not None:
+                trackers[player].claim(next_move)
+                trackers[not player].block(next_move)
+
+            if player == RED:
+                red_moves.add(next_move)
+
+                # check win condition
+                if connectivity.add(next_move, RED):
                     game_over = True
                     print_grid(rows, cols, red_moves, blue_moves, False)
                     print("Red wins!")
+                    break
 
-            # remove minimal winning paths containing new Red
-            # tile from Blue's path set
-            new_blue_paths = [p for p in blue_paths if next_move not in p]
-            blue_paths = new_blue_paths
+                # remove minimal winning paths containing new Red
+                # tile from Blue's path set
+                blue_paths = remove_paths_through(blue_paths, next_move)
 
-        else:
-            blue_moves.add(next_move)
+            else:
+                blue_moves.add(next_move)
 
-            # check win condition
-            for path in blue_paths:
-                if path.issubset(blue_moves):
+                # check win condition
+                if connectivity.add(next_move, BLUE):
                     game_over = True
                     print_grid(rows, cols, red_moves, blue_moves, False)
                     print("Blue wins!")
+                    break
 
-            # remove minimal winning paths containing new Blue
-            # tile from Red's path set
-            new_red_paths = [p for p in red_paths if next_move not in p]
-            red_paths = new_red_paths
-
-        player = not player
-        assert(not bool(red_moves.intersection(blue_moves)))
-    exit(0)
-
+                # remove minimal winning paths containing new Blue
+                # tile from Red's path set
+                red_paths = remove_paths_through(red_paths, next_move)
 
+            player = not player
+            assert(not bool(red_moves.intersection(blue_moves)))
+        exit(0)
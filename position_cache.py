@@ -0,0 +1,270 @@
+"""
+A bounded, optionally persistent cache of compute_optimal_move's answers,
+keyed by position up to the symmetries of the board.
+
+Turning the board by 180 degrees keeps both players' edges, and so does
+transposing it while swapping the colours (Red's rows become Blue's
+columns). Neither changes the potential strategy's choice, so a position
+is looked up by the smallest of its four images, and the move stored for
+that image is mapped back. Blue's paths are found as Red's on the
+transposed board, which only fits the grid if it is square, so other
+grids are cached as they are. When several moves are equally
+good, a symmetric position may get the image of another one than a fresh
+computation would pick, and with it another resulting potential.
+
+Caching is off until enable() is called; from then on every call of a
+function wrapped by cached() in the process shares one cache. With a
+filename, the cache is loaded from that file and written back at exit.
+A worker process keeps a cache of its own, and hands the entries it
+computes to the main process with take_added(), to be merged there.
+"""
+import atexit
+import functools
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import profiler
+
+CACHE_VERSION = 1
+DEFAULT_MAX_ENTRIES = 100000
+
+# (backend, rows, cols, red cells, blue cells, player to move), with the
+# cells as bitmasks indexed by y * cols + x
+Key = Tuple[str, int, int, int, int, bool]
+
+
+def transform(cell: Tuple[int, int], rows: int, cols: int, rotate: bool,
+              transpose: bool) -> Tuple[int, int]:
+    '''
+    Return the image of cell of a rows x cols grid, turned by 180 degrees
+    if rotate is set and then transposed if transpose is set. Every such
+    map is its own inverse, given the size of the grid it is applied to.
+    '''
+    x, y = cell
+    if rotate:
+        x, y = cols - 1 - x, rows - 1 - y
+    if transpose:
+        x, y = y, x
+    return x, y
+
+
+def to_mask(cells: Iterable[Tuple[int, int]], cols: int) -> int:
+    mask = 0
+    for x, y in cells:
+        mask |= 1 << (y * cols + x)
+    return mask
+
+
+def images(rows: int, cols: int, red_moves: Iterable[Tuple[int, int]],
+           blue_moves: Iterable[Tuple[int, int]]):
+    '''
+    Yield the rotate and transpose flags of every symmetry of the grid
+    (see transform), with the rows, columns, Red and Blue cell bitmasks
+    of the position's image under it. The transposes swap the colours.
+    '''
+    red_moves, blue_moves = list(red_moves), list(blue_moves)
+    maps = [(False, False)]
+    if rows == cols:
+        maps += [(False, True), (True, False), (True, True)]
+    for rotate, transpose in maps:
+        red = [transform(c, rows, cols, rotate, transpose)
+               for c in red_moves]
+        blue = [transform(c, rows, cols, rotate, transpose)
+                for c in blue_moves]
+        if transpose:
+            yield rotate, transpose, (cols, rows, to_mask(blue, rows),
+                                      to_mask(red, rows))
+        else:
+            yield rotate, transpose, (rows, cols, to_mask(red, cols),
+                                      to_mask(blue, cols))
+
+
+def canonical_key(rows: int, cols: int, red_moves: Iterable[Tuple[int, int]],
+                  blue_moves: Iterable[Tuple[int, int]], turn: bool,
+                  backend: str) -> Tuple[Key, bool, bool]:
+    '''
+    Return the smallest key among the position's symmetric images, with
+    the rotate and transpose flags of the map (see transform) that gives it.
+    '''
+    best = None
+    for rotate, transpose, image in images(rows, cols, red_moves,
+                                           blue_moves):
+        key = (backend,) + image + (not turn if transpose else turn,)
+        if best is None or key < best[0]:
+            best = (key, rotate, transpose)
+    return best
+
+
+def canonical_board(rows: int, cols: int,
+                    red_moves: Iterable[Tuple[int, int]],
+                    blue_moves: Iterable[Tuple[int, int]]
+                    ) -> Tuple[int, int, int, int]:
+    '''
+    Return the smallest of the stones' images under the symmetries that
+    keep the colours, as rows, columns and the Red and Blue bitmasks. With
+    the same player to move, the colour-swapped transpose is the position
+    with the other player to move, so it is not a copy.
+    '''
+    return min(image for _, transpose, image
+               in images(rows, cols, red_moves, blue_moves) if not transpose)
+
+
+class PositionCache:
+    '''
+    The chosen move and resulting potential of up to max_entries
+    positions, dropping the least recently used first. hits and misses
+    count the lookups.
+    '''
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 filename: str = None) -> None:
+        self.max_entries = max_entries
+        self.filename = filename
+        self.entries: 'OrderedDict[Key, Tuple[Tuple[int, int], float]]' = \
+            OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # the keys put since the last take_added(), once record_added() is
+        # called
+        self.added: Optional[List[Key]] = None
+        if filename is not None:
+            self.load()
+
+    def get(self, rows: int, cols: int, red_moves: Iterable[Tuple[int, int]],
+            blue_moves: Iterable[Tuple[int, int]], turn: bool,
+            backend: str) -> Optional[Tuple[Tuple[int, int], float]]:
+        ''' Return the cached move and potential, or None. '''
+        key, rotate, transpose = canonical_key(rows, cols, red_moves,
+                                               blue_moves, turn, backend)
+        found = self.entries.get(key)
+        if found is None:
+            self.misses += 1
+            profiler.count('position cache: misses')
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        profiler.count('position cache: hits')
+        move, potential = found
+        return transform(move, key[1], key[2], rotate, transpose), potential
+
+    def put(self, rows: int, cols: int, red_moves: Iterable[Tuple[int, int]],
+            blue_moves: Iterable[Tuple[int, int]], turn: bool, backend: str,
+            move: Tuple[int, int], potential: float) -> None:
+        key, rotate, transpose = canonical_key(rows, cols, red_moves,
+                                               blue_moves, turn, backend)
+        self.entries[key] = (transform(move, rows, cols, rotate, transpose),
+                             potential)
+        self.entries.move_to_end(key)
+        if self.added is not None:
+            self.added.append(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def record_added(self) -> None:
+        ''' Start remembering the keys put, for take_added(). '''
+        self.added = []
+
+    def take_added(self) -> List[list]:
+        '''
+        Return the entries put since the last call that are still cached,
+        in the format of the cache file, for merge() in another process.
+        '''
+        added, self.added = self.added, []
+        return [self.dump_entry(key) for key in dict.fromkeys(added)
+                if key in self.entries]
+
+    def dump_entry(self, key: Key) -> list:
+        move, potential = self.entries[key]
+        return list(key) + [move[0], move[1], potential]
+
+    def load(self) -> None:
+        ''' Add the well-formed entries of the cache file, if it has any. '''
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return
+        entries = data.get('entries')
+        if isinstance(entries, list):
+            self.merge(entries)
+
+    def merge(self, entries: list) -> None:
+        '''
+        Add the well-formed ones of entries in the format of the cache
+        file, as the most recently used.
+        '''
+        for entry in entries:
+            try:
+                backend, rows, cols, red, blue, turn, x, y, potential = entry
+            except (TypeError, ValueError):  # skip malformed entries
+                continue
+            if not isinstance(backend, str) \
+                    or not all(type(v) is int
+                               for v in (rows, cols, red, blue, x, y)) \
+                    or not isinstance(turn, bool) \
+                    or type(potential) not in (int, float):
+                continue
+            key = (backend, rows, cols, red, blue, turn)
+            self.entries[key] = ((x, y), potential)
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self) -> None:
+        ''' Write the entries to the cache file, least recently used first. '''
+        entries = [self.dump_entry(key) for key in self.entries]
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        # write to a temporary file first so readers never see half a cache
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'entries': entries}, f)
+            os.replace(temp_name, self.filename)
+        except OSError:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+
+
+shared: Optional[PositionCache] = None
+
+
+def enable(max_entries: int = DEFAULT_MAX_ENTRIES, filename: str = None,
+           save_at_exit: bool = True) -> PositionCache:
+    '''
+    Start caching in this process, loading from filename if one is given,
+    and saving to it at exit unless save_at_exit is unset, and return the
+    cache.
+    '''
+    global shared
+    if shared is None:
+        shared = PositionCache(max_entries, filename)
+        if filename is not None and save_at_exit:
+            atexit.register(shared.save)
+    return shared
+
+
+def cached(function):
+    '''
+    Decorator looking up the answers of compute_optimal_move (or a function
+    with its signature) in the shared cache, once caching is enabled.
+    '''
+    @functools.wraps(function)
+    def wrapper(rows, cols, red_moves, blue_moves, red_paths, blue_paths,
+                turn, backend='sets', open_tiles=None):
+        if shared is None:
+            return function(rows, cols, red_moves, blue_moves, red_paths,
+                            blue_paths, turn, backend, open_tiles)
+        found = shared.get(rows, cols, red_moves, blue_moves, turn, backend)
+        if found is not None:
+            return found
+        move, potential = function(rows, cols, red_moves, blue_moves,
+                                   red_paths, blue_paths, turn, backend,
+                                   open_tiles)
+        shared.put(rows, cols, red_moves, blue_moves, turn, backend, move,
+                   potential)
+        return move, potential
+    return wrapper
@@ -0,0 +1,98 @@
+"""
+Incremental Erdos-Selfridge potential for a family of winning sets.
+"""
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+class PotentialTracker:
+    '''
+    Keep track of the Erdos-Selfridge potential of one player's winning
+    sets, i.e. the sum of (1/2)^(# of cells of the set the player has not
+    claimed yet) over every set the opponent has not blocked.
+
+    For every cell we also keep the sum of those terms over the live sets
+    through it. This is how much the potential grows if the player claims
+    the cell, and how much it drops if the opponent blocks it, so reading
+    the best move is O(cells). Claiming or blocking a cell only touches the
+    sets through that cell, and both can be undone.
+
+    Weights are stored as integers scaled by 2^(size of the largest set),
+    so that any sequence of updates and undos is exact.
+    '''
+    def __init__(self, winning_sets: Iterable[Iterable[Hashable]],
+                 claimed: Iterable[Hashable] = (),
+                 blocked: Iterable[Hashable] = ()) -> None:
+        self.sets = [tuple(s) for s in winning_sets]
+        self.scale = max((len(s) for s in self.sets), default=0)
+        self.remaining = [len(s) for s in self.sets]
+        self.blockers = [0] * len(self.sets)
+        self.sets_through: Dict[Hashable, List[int]] = {}
+        self.cell_weights: Dict[Hashable, int] = {}
+        self.total = 0
+
+        for i, s in enumerate(self.sets):
+            for cell in s:
+                self.sets_through.setdefault(cell, []).append(i)
+                self.cell_weights.setdefault(cell, 0)
+            self._shift(i, self._weight(i))
+
+        for cell in claimed:
+            self.claim(cell)
+        for cell in blocked:
+            self.block(cell)
+
+    def _weight(self, i: int) -> int:
+        return 1 << (self.scale - self.remaining[i])
+
+    def _shift(self, i: int, amount: int) -> None:
+        # add amount to the potential and to every cell of set i
+        self.total += amount
+        for cell in self.sets[i]:
+            self.cell_weights[cell] += amount
+
+    def claim(self, cell: Hashable) -> None:
+        ''' The tracked player takes cell. '''
+        for i in self.sets_through.get(cell, ()):
+            if not self.blockers[i]:
+                self._shift(i, self._weight(i))  # the weight doubles
+            self.remaining[i] -= 1
+
+    def unclaim(self, cell: Hashable) -> None:
+        ''' Undo claim(cell). '''
+        for i in self.sets_through.get(cell, ()):
+            self.remaining[i] += 1
+            if not self.blockers[i]:
+                self._shift(i, -self._weight(i))
+
+    def block(self, cell: Hashable) -> None:
+        ''' The opponent takes cell, killing every set through it. '''
+        for i in self.sets_through.get(cell, ()):
+            self.blockers[i] += 1
+            if self.blockers[i] == 1:
+                self._shift(i, -self._weight(i))
+
+    def unblock(self, cell: Hashable) -> None:
+        ''' Undo block(cell). '''
+        for i in self.sets_through.get(cell, ()):
+            self.blockers[i] -= 1
+            if self.blockers[i] == 0:
+                self._shift(i, self._weight(i))
+
+    def potential(self) -> float:
+        return self.total / (1 << self.scale)
+
+    def gain(self, cell: Hashable) -> float:
+        '''
+        Return how much the potential changes if cell is claimed (or,
+        with the opposite sign, blocked).
+        '''
+        return self.cell_weights.get(cell, 0) / (1 << self.scale)
+
+    def best_cell(self, cells: List[Hashable]) -> Tuple[Hashable, float]:
+        '''
+        Return the first of cells with the largest gain, and the potential
+        that results from claiming it.
+        '''
+        best = max(cells, key=lambda cell: self.cell_weights.get(cell, 0))
+        total = self.total + self.cell_weights.get(best, 0)
+        return best, total / (1 << self.scale)
@@ -0,0 +1,127 @@
+"""
+Counters and per-phase timers showing where a run spends its time.
+
+Profiling is off until enable() is called. Until then count() returns at
+once and phase() hands out a shared context manager that does nothing,
+so instrumentation costs next to nothing when disabled. Hot loops keep
+their counts in local variables and pass the totals to count() once.
+Worker processes are profiled on their own; a worker hands its counts
+to the main process with take(), and the main process adds them with
+merge().
+"""
+import atexit
+import functools
+import sys
+import time
+from typing import Dict, List
+
+enabled = False
+counters: Dict[str, int] = {}
+timers: Dict[str, List[float]] = {}  # name -> [# of calls, seconds]
+started = time.perf_counter()
+
+
+class Phase:
+    ''' Add the time spent in a with block to timers[name]. '''
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> 'Phase':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        timer = timers.setdefault(self.name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += time.perf_counter() - self.start
+        return False
+
+
+class NoPhase:
+    __slots__ = ()
+
+    def __enter__(self) -> 'NoPhase':
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+NO_PHASE = NoPhase()
+
+
+def enable(report_at_exit: bool = True) -> None:
+    ''' Start profiling, and print the breakdown when the program exits. '''
+    global enabled, started
+    if not enabled and report_at_exit:
+        atexit.register(print_report)
+    enabled = True
+    started = time.perf_counter()
+
+
+def count(name: str, amount: int = 1) -> None:
+    if enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def phase(name: str):
+    ''' Return a context manager timing its block as the phase name. '''
+    return Phase(name) if enabled else NO_PHASE
+
+
+def timed(name: str):
+    ''' Decorator timing every call of a function as the phase name. '''
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def take():
+    ''' Return the counters and timers, and start them again from zero. '''
+    global counters, timers
+    taken = counters, timers
+    counters, timers = {}, {}
+    return taken
+
+
+def merge(other_counters: Dict[str, int],
+          other_timers: Dict[str, List[float]]) -> None:
+    '''
+    Add counters and timers taken in another process. The seconds of the
+    processes add up, so the phases may take more than the total time.
+    '''
+    for name, amount in other_counters.items():
+        counters[name] = counters.get(name, 0) + amount
+    for name, (calls, seconds) in other_timers.items():
+        timer = timers.setdefault(name, [0, 0.0])
+        timer[0] += calls
+        timer[1] += seconds
+
+
+def print_report(file=None) -> None:
+    '''
+    Print the time spent in every phase, slowest first, and the counters.
+    A phase's time includes the phases run inside it.
+    '''
+    file = sys.stderr if file is None else file
+    sys.stdout.flush()  # print after the program's own output
+    total = time.perf_counter() - started
+    print('\nprofile: %.3f s in total' % total, file=file)
+    width = max((len(name) for name in list(timers) + list(counters)),
+                default=0)
+    for name, (calls, seconds) in sorted(timers.items(),
+                                         key=lambda item: -item[1][1]):
+        print('  %-*s %10.3f s %5.1f%% %10d calls' % (
+            width, name, seconds, 100 * seconds / total if total else 0,
+            calls), file=file)
+    for name, amount in sorted(counters.items()):
+        print('  %-*s %12d' % (width, name, amount), file=file)
@@ -1,21 +1,29 @@
+import argparse
+import json
+import os
 import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import position_cache
+import profiler
 from hex import *
 
 GRID_SIZE = 5
+BATCH_SIZE = 2000  # candidates per task handed to a worker process
 
 # Format: puzzle_number: [rows, cols,
 #                         [red cells],
 #                         [blue cells]]
 
 
-def build_random_puzzle():
+def build_random_puzzle(rng: random.Random = random):
 
     red_cells = []
     blue_cells = []
 
     for i in range(GRID_SIZE):
         for j in range(GRID_SIZE):
-            num = random.randint(0, 2)
+            num = rng.randint(0, 2)
             if num == 0:
                 red_cells.append((i, j))
             elif num == 1:
@@ -24,38 +32,275 @@ def build_random_puzzle():
     return [GRID_SIZE, GRID_SIZE, red_cells, blue_cells]
 
 
-def main():
+class PathFilter:
+    '''
+    Both players' minimal paths on the empty rows x cols grid, each with
+    its bitmask. Minimality does not depend on the stones, so the paths of
+    a position are those of the empty grid missing the opponent's stones,
+    in the order find_paths would list them. They are read off the full
+    families with one AND per path instead of a new search.
+    '''
+    def __init__(self, rows: int, cols: int, cache: PathCache = None) -> None:
+        self.rows = rows
+        self.cols = cols
+        self.families = {}
+        for player in (RED, BLUE):
+            paths = find_paths(rows, cols, [], player, True,
+                               cache=cache).paths
+            self.families[player] = [(cells_to_mask(cols, p), p)
+                                     for p in paths]
+
+    def paths(self, player: bool, opponent_cells: Iterable[Tuple[int, int]]
+              ) -> List[Set[Tuple[int, int]]]:
+        ''' Return player's paths avoiding opponent_cells. '''
+        blocked = cells_to_mask(self.cols, opponent_cells)
+        return [p for mask, p in self.families[player] if not mask & blocked]
+
+
+STAGES = ['stones', 'duplicate', 'potential']
+
+
+class PuzzleFilter:
+    '''
+    Decide which puzzles are good ones, in stages from the cheapest: the
+    stones must be balanced and few enough to leave two cells open, the
+    puzzle must not be a symmetric copy (see position_cache.canonical_board)
+    of one accepted before, and Blue's optimal move must leave Red a
+    potential strictly between 0 and 1. rejected counts the puzzles turned
+    away at each stage and accepted the rest. Only accepted puzzles are
+    remembered: a copy of a rejected one may break a tie between Blue's
+    best moves differently, and so pass.
+    '''
+    def __init__(self, path_filter: PathFilter) -> None:
+        self.path_filter = path_filter
+        self.seen = set()
+        self.rejected = {stage: 0 for stage in STAGES}
+        self.accepted = 0
+
+    def accept(self, puzzle):
+        '''
+        Return the potential Red can reach after Blue's optimal move in the
+        puzzle if it is a good one, and None otherwise.
+        '''
+        rows, cols, red_cells, blue_cells = puzzle
+        if len(red_cells) != len(blue_cells) or len(blue_cells) >= 6 \
+                or rows * cols - len(red_cells) - len(blue_cells) < 2:
+            self.rejected['stones'] += 1
+            return None
+        key = position_cache.canonical_board(rows, cols, red_cells,
+                                             blue_cells)
+        if key in self.seen:
+            self.rejected['duplicate'] += 1
+            return None
+
+        red_paths = self.path_filter.paths(RED, blue_cells)
+        blue_paths = self.path_filter.paths(BLUE, red_cells)
+        # we use the convention that it is the Blue player's turn
+        _, potential = compute_optimal_move(rows, cols, set(red_cells),
+                                            set(blue_cells), red_paths,
+                                            blue_paths, BLUE, 'tracker')
+        if not 0.0 < potential < 1.0:
+            self.rejected['potential'] += 1
+            return None
+        self.seen.add(key)
+        self.accepted += 1
+        return potential
+
+
+def main(cache: PathCache = None):
 
     candidate_puzzles = []
+    puzzle_filter = PuzzleFilter(PathFilter(GRID_SIZE, GRID_SIZE, cache))
 
     while True:
         puzzle = build_random_puzzle()
+        if puzzle_filter.accept(puzzle) is not None:
+            rows, cols, red_cells, blue_cells = puzzle
+            candidate_puzzles.append(puzzle)
+            print_grid(rows, cols, set(red_cells), set(blue_cells), False)
+            _ = input('Press enter to continue')
+
+
+worker_filter = None  # the PuzzleFilter of a worker process
 
-        rows = puzzle[0]
-        cols = puzzle[1]
-        red_cells = puzzle[2]
-        blue_cells = puzzle[3]
-
-        if len(get_open_tiles(rows, cols, set(red_cells), set(blue_cells))) >= 2:
-            red_paths = compute_paths(rows, cols, blue_cells, RED, False)
-            blue_paths = compute_paths(rows, cols, red_cells, BLUE, False)
-
-            # we use the convention that it is the Blue player's turn
-            _, potential = compute_optimal_move(rows,
-                                                cols,
-                                                set(red_cells),
-                                                set(blue_cells),
-                                                red_paths,
-                                                blue_paths,
-                                                BLUE)
-            if 0.0 < potential < 1.0 and len(red_cells) - len(blue_cells) == 0:
-                if len(blue_cells) < 6:
-                    candidate_puzzles.append(puzzle)
-                    print_grid(rows, cols,
-                               set(red_cells), set(blue_cells),
-                               False)
-                    _ = input('Press enter to continue')
+
+def init_worker(cache: PathCache = None, profiling: bool = False,
+                position_caching: bool = False,
+                position_cache_file: str = None) -> None:
+    '''
+    Set up a worker process. With profiling or position_caching, the
+    worker profiles or caches positions on its own (loading the cache from
+    position_cache_file, but leaving the saving to the main process), and
+    generate_batch hands the results over.
+    '''
+    global worker_filter
+    if profiling:
+        profiler.enable(report_at_exit=False)
+    if position_caching:
+        position_cache.enable(filename=position_cache_file,
+                              save_at_exit=False).record_added()
+    worker_filter = PuzzleFilter(PathFilter(GRID_SIZE, GRID_SIZE, cache))
+
+
+def generate_batch(count: int, seed: int):
+    '''
+    Evaluate count random puzzles in a worker process. Return the good
+    ones with their potentials and canonical forms, the numbers of
+    puzzles the worker's filter rejected at each stage, and the worker's
+    position cache entries and profile since the last batch (see
+    PositionCache.take_added and profiler.take). The filter keeps the
+    puzzles it has accepted across batches, so that only the copies found
+    by other workers reach the main process.
+    '''
+    rng = random.Random(seed)
+    rejected = dict(worker_filter.rejected)
+    accepted = []
+    for _ in range(count):
+        puzzle = build_random_puzzle(rng)
+        potential = worker_filter.accept(puzzle)
+        if potential is not None:
+            rows, cols, red_cells, blue_cells = puzzle
+            key = position_cache.canonical_board(rows, cols, red_cells,
+                                                 blue_cells)
+            accepted.append((puzzle, potential, key))
+    cached = position_cache.shared.take_added() \
+        if position_cache.shared is not None else []
+    profile = profiler.take() if profiler.enabled else ({}, {})
+    return accepted, {stage: worker_filter.rejected[stage] - rejected[stage]
+                      for stage in STAGES}, cached, profile
+
+
+def read_seen(filename: str) -> Set:
+    ''' Return the canonical forms of the puzzles already in filename. '''
+    seen = set()
+    if not os.path.exists(filename):
+        return seen
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                puzzle = json.loads(line)
+                seen.add(position_cache.canonical_board(
+                    puzzle['rows'], puzzle['cols'],
+                    map(tuple, puzzle['red_cells']),
+                    map(tuple, puzzle['blue_cells'])))
+    return seen
+
+
+def generate(filename: str, target: int = None, seconds: float = None,
+             workers: int = 1, cache: PathCache = None,
+             seed: int = None) -> Dict:
+    '''
+    Evaluate random puzzles in batches across a pool of workers processes
+    until target puzzles have been accepted or seconds have passed
+    (whichever comes first; at least one of them must be given), and
+    append the accepted ones to filename as JSON lines, leaving out
+    symmetric copies of each other and of the puzzles already in it.
+    Batches still running when the goal is reached are waited for, and
+    their puzzles kept. Return the numbers of candidates, of puzzles
+    rejected at each stage (see PuzzleFilter) and of accepted puzzles,
+    the seconds taken and the rates. If profiling or position caching is
+    enabled in this process, the workers' profiles and new cache entries
+    are merged into it.
+    '''
+    seeds = random.Random(seed)
+    seen = read_seen(filename)
+    start = time.perf_counter()
+    deadline = start + seconds if seconds is not None else None
+    candidates = 0
+    rejected = {stage: 0 for stage in STAGES}
+    accepted = 0
+
+    def done() -> bool:
+        return (target is not None and accepted >= target) \
+            or (deadline is not None and time.perf_counter() >= deadline)
+
+    shared_cache = position_cache.shared
+    initargs = (cache, profiler.enabled, shared_cache is not None,
+                shared_cache.filename if shared_cache is not None else None)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=initargs) as executor, \
+            open(filename, 'a') as f:
+        running = set()
+        while running or not done():
+            while not done() and len(running) < 2 * workers:
+                running.add(executor.submit(generate_batch, BATCH_SIZE,
+                                            seeds.getrandbits(64)))
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                batch, batch_rejected, cached, profile = future.result()
+                if shared_cache is not None:
+                    shared_cache.merge(cached)
+                profiler.merge(*profile)
+                candidates += BATCH_SIZE
+                for stage in STAGES:
+                    rejected[stage] += batch_rejected[stage]
+                for puzzle, potential, key in batch:
+                    if key in seen:
+                        rejected['duplicate'] += 1
+                        continue
+                    seen.add(key)
+                    accepted += 1
+                    rows, cols, red_cells, blue_cells = puzzle
+                    f.write(json.dumps({'rows': rows, 'cols': cols,
+                                        'red_cells': red_cells,
+                                        'blue_cells': blue_cells,
+                                        'potential': potential}) + '\n')
+                f.flush()
+
+    seconds = time.perf_counter() - start
+    return {'candidates': candidates, 'rejected': rejected,
+            'accepted': accepted, 'seconds': seconds,
+            'candidates_per_second': candidates / seconds if seconds else 0,
+            'acceptance_rate': accepted / candidates if candidates else 0}
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default=None,
+                        help='generate puzzles without stopping for input, '
+                             'appending them to this file as JSON lines')
+    parser.add_argument('--count', type=int, default=None,
+                        help='with --output, stop after this many puzzles')
+    parser.add_argument('--seconds', type=float, default=None,
+                        help='with --output, stop after this many seconds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes for --output')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for a reproducible --output run')
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help='keep computed paths in the on-disk path cache')
+    parser.add_argument('--position-cache', action='store_true',
+                        default=False,
+                        help='remember the potential strategy\'s move for '
+                             'every position (up to symmetry) seen in this '
+                             'run')
+    parser.add_argument('--position-cache-file', type=str, default=None,
+                        help='file to load the position cache from and save '
+                             'it to at exit (implies --position-cache)')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='print where the time went at exit (with '
+                             '--output, the phases add up the workers\' '
+                             'time)')
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
+    if args.position_cache or args.position_cache_file:
+        position_cache.enable(filename=args.position_cache_file)
+    if args.output is None:
+        if args.count is not None or args.seconds is not None:
+            parser.error('--count and --seconds need --output')
+        main(PathCache() if args.cache else None)
+        exit(0)
+    if args.count is None and args.seconds is None:
+        parser.error('--output needs --count or --seconds')
+
+    stats = generate(args.output, args.count, args.seconds, args.workers,
+                     PathCache() if args.cache else None, args.seed)
+    print(str(stats['accepted']) + ' puzzles accepted out of '
+          + str(stats['candidates']) + ' candidates ('
+          + '%.2f%%) in %.1f s, %.0f candidates per second' % (
+              100 * stats['acceptance_rate'], stats['seconds'],
+              stats['candidates_per_second']))
+    for stage in STAGES:
+        print('rejected at %-10s %d' % (stage + ':',
+                                        stats['rejected'][stage]))
@@ -0,0 +1,503 @@
+"""
+An exact solver for Hex positions, to check the potential strategy's
+answers to the polygon puzzles against the true winning moves.
+
+The search is depth-first proof-number search (df-pn) over bitmask
+positions: it keeps expanding the moves that look closest to proving a
+win or a loss, so forced lines are settled without going through the
+whole tree. Positions are hashed by Zobrist keys into a transposition
+table, so a position reached by several move orders is only expanded
+once. Every position is first checked for what settles most of Hex:
+- a player to move who can connect with one stone has won, and one
+  facing two such cells of the opponent has lost;
+- a player who can no longer connect through their own and open cells
+  has lost;
+- a cell neither player can still connect through is dead: its colour
+  cannot change the outcome, so it is never searched;
+- virtual connections between the edges, from a small H-search: a player
+  to move with a semi-connection has won, a player whose opponent has a
+  virtual connection has lost, and otherwise has to play into every
+  semi-connection of the opponent's.
+The other moves are tried in the order of the Erdos-Selfridge gains that
+compute_optimal_move maximizes, so the winning move usually comes first.
+
+ex: python solver.py 9 43 --player blue
+"""
+import argparse
+import random
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+from hex import BLUE, RED, compute_optimal_move, find_paths, flood, get_board
+from potential import PotentialTracker
+
+ORDER_DEPTH = 2  # nodes this deep or deeper reuse their ancestor's ordering
+INFINITY = 1 << 40  # the proof number of a disproved position
+EPSILON = 0.25  # slack of the 1 + epsilon trick, to switch branches less
+MAX_VCS = 4  # virtual connections kept per pair of points
+MAX_SCS = 8  # semi-connections kept per pair of points
+MAX_NODES = 50000  # default node budget per puzzle of the command line
+
+
+class NodeLimitReached(Exception):
+    pass
+
+
+def edge_connections(board, player: bool, own: int,
+                     open_mask: int) -> Tuple[List[int], List[int]]:
+    '''
+    Derive player's virtual connections between their edges by H-search
+    (Anshelevich), for the given stones own and open cells, and return the
+    carriers of those found: the cells of a virtual connection (VC) let
+    player connect even moving second, by answering every intrusion into
+    them; a semi-connection (SC) needs player to move first.
+
+    The points connected are player's two edges, their groups of stones
+    and the open cells. Touching points have an empty VC. Two VCs joined
+    through a group make a VC, and through an open cell an SC that includes
+    the cell, if their carriers are disjoint (the AND rule). SCs of the
+    same two points whose carriers have nothing in common make a VC (the
+    OR rule). At most MAX_VCS and MAX_SCS are kept per pair of points, so
+    not every connection is found, but every one found is real.
+    '''
+    cols, has_left, has_right = board.cols, board.has_left, board.has_right
+    start, goal = board.edges(player)
+    masks = [0, 0]  # the edges are points 0 and 1, and cover no cells
+    rest = own
+    while rest:
+        group = flood(rest & -rest, own, cols, has_left, has_right)
+        rest &= ~group
+        masks.append(group)
+    first_open = len(masks)
+    rest = open_mask
+    while rest:
+        bit = rest & -rest
+        rest ^= bit
+        masks.append(bit)
+
+    # the connections of points a < b are kept under a * n + b
+    n = len(masks)
+    vcs: Dict[int, List[int]] = {}
+    scs: Dict[int, List[int]] = {}
+    partners: List[Set[int]] = [set() for _ in masks]
+    queue = []
+
+    def add_vc(a: int, b: int, carrier: int) -> None:
+        found = vcs.setdefault(a * n + b if a < b else b * n + a, [])
+        for c in found:
+            if c & carrier == c:
+                return  # no better than a known one
+        if len(found) >= MAX_VCS:
+            return
+        found.append(carrier)
+        partners[a].add(b)
+        partners[b].add(a)
+        queue.append((a, b, carrier))
+
+    def add_sc(a: int, b: int, carrier: int) -> None:
+        pair = a * n + b if a < b else b * n + a
+        for c in vcs.get(pair, ()):
+            if c & carrier == c:
+                return
+        found = scs.setdefault(pair, [])
+        for c in found:
+            if c & carrier == c:
+                return
+        if len(found) >= MAX_SCS:
+            return
+        found.append(carrier)
+        # OR rule: look for SCs with the new one whose carriers have no
+        # cell in common
+        stack = [(0, carrier, carrier)]
+        while stack:
+            i, union, common = stack.pop()
+            for j in range(i, len(found) - 1):
+                c = found[j]
+                if common & c == common:
+                    continue  # no closer to an empty intersection
+                if not common & c:
+                    add_vc(a, b, union | c)
+                    return
+                stack.append((j + 1, union | c, common & c))
+
+    # touching points
+    ends = (start, goal)
+    for p in range(2, n):
+        for edge in (0, 1):
+            if masks[p] & ends[edge]:
+                add_vc(edge, p, 0)
+        grown = masks[p]
+        left = grown & has_left
+        right = grown & has_right
+        grown = (grown << cols | grown >> cols | right << 1
+                 | right << (cols + 1) | left >> 1 | left >> (cols + 1))
+        for q in range(max(p + 1, first_open), n):
+            if grown & masks[q]:
+                add_vc(p, q, 0)
+
+    # AND rule over every new VC, taking either end as the middle point;
+    # connections between two open cells are only used, not derived
+    while queue:
+        a, b, carrier = queue.pop()
+        for x, z in ((a, b), (b, a)):
+            if z < 2:
+                continue
+            z_open = z >= first_open
+            x_open = x >= first_open
+            x_mask = masks[x]
+            z_mask = masks[z]
+            for y in tuple(partners[z]):
+                if y == x or x_open and y >= first_open or masks[y] & carrier:
+                    continue
+                for other in tuple(vcs[z * n + y if z < y else y * n + z]):
+                    if carrier & other or x_mask & other:
+                        continue
+                    if z_open:
+                        add_sc(x, y, carrier | other | z_mask)
+                    else:
+                        add_vc(x, y, carrier | other)
+    return vcs.get(1, []), scs.get(1, [])
+
+
+class Solver:
+    '''
+    Solve positions on a rows x cols grid, starting from the given stones.
+    If the players' winning paths are given (lists of sets of cells, e.g.
+    from find_paths), the moves are ordered by the potential; otherwise by
+    distance from the centre. The transposition table is kept between
+    calls. nodes counts the positions expanded, and probes and hits the
+    visits to positions and those to positions expanded before. Once more
+    than max_nodes positions are expanded, NodeLimitReached is raised and
+    the solver cannot be used any more.
+    '''
+    def __init__(self, rows: int, cols: int, red_moves: Set[Tuple[int, int]],
+                 blue_moves: Set[Tuple[int, int]],
+                 red_paths: Iterable[Set[Tuple[int, int]]] = None,
+                 blue_paths: Iterable[Set[Tuple[int, int]]] = None,
+                 max_nodes: int = None, seed: int = 0) -> None:
+        self.board = board = get_board(rows, cols)
+        size = len(board.cells)
+        self.full = (1 << size) - 1
+        rng = random.Random(seed)
+        self.keys = {player: [rng.getrandbits(64) for _ in range(size)]
+                     for player in (RED, BLUE)}
+        self.side = {RED: rng.getrandbits(64), BLUE: rng.getrandbits(64)}
+        self.masks = {RED: 0, BLUE: 0}
+        self.hash = 0
+        for player, moves in ((RED, red_moves), (BLUE, blue_moves)):
+            for cell in moves:
+                self.place(board.index[cell], player)
+
+        self.trackers = None
+        if red_paths is not None and blue_paths is not None:
+            self.trackers = {
+                RED: PotentialTracker(red_paths, claimed=red_moves,
+                                      blocked=blue_moves),
+                BLUE: PotentialTracker(blue_paths, claimed=blue_moves,
+                                       blocked=red_moves)}
+        centre_x, centre_y = (cols - 1) / 2, (rows - 1) / 2
+        self.central = sorted(range(size), key=lambda i: (
+            abs(board.cells[i][0] - centre_x)
+            + abs(board.cells[i][1] - centre_y)))
+
+        self.line: List[Tuple[int, bool]] = []  # the moves searched
+        self.table: Dict[int, Tuple[int, int]] = {}
+        self.expanded: Dict[int, Tuple[List[int], List[int]]] = {}
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.probes = 0
+        self.hits = 0
+
+    def place(self, i: int, player: bool) -> None:
+        self.masks[player] |= 1 << i
+        self.hash ^= self.keys[player][i]
+
+    def remove(self, i: int, player: bool) -> None:
+        self.masks[player] &= ~(1 << i)
+        self.hash ^= self.keys[player][i]
+
+    def grow(self, mask: int) -> int:
+        ''' Return mask with all the neighbours of its cells. '''
+        board = self.board
+        cols = board.cols
+        left = mask & board.has_left
+        right = mask & board.has_right
+        return self.full & (mask | mask << cols | mask >> cols | right << 1
+                            | right << (cols + 1) | left >> 1
+                            | left >> (cols + 1))
+
+    def edge_groups(self, player: bool) -> Tuple[int, int]:
+        ''' Return player's stones connected to either of their edges. '''
+        board = self.board
+        start, goal = board.edges(player)
+        own = self.masks[player]
+        return (flood(own & start, own, board.cols, board.has_left,
+                      board.has_right),
+                flood(own & goal, own, board.cols, board.has_left,
+                      board.has_right))
+
+    def winning_cells(self, player: bool, open_mask: int) -> int:
+        ''' Return the open cells that connect player's edges at once. '''
+        start, goal = self.board.edges(player)
+        from_start, from_goal = self.edge_groups(player)
+        return (open_mask & (self.grow(from_start) | start)
+                & (self.grow(from_goal) | goal))
+
+    def reachable(self, player: bool, open_mask: int) -> int:
+        '''
+        Return the cells of player and open cells that player can reach
+        from both edges through such cells. Only these can lie on a
+        connection of player's, and there is none if the result is 0.
+        '''
+        board = self.board
+        start, goal = board.edges(player)
+        allowed = self.masks[player] | open_mask
+        from_start = flood(allowed & start, allowed, board.cols,
+                           board.has_left, board.has_right)
+        if not from_start & goal:
+            return 0
+        return from_start & flood(allowed & goal, allowed, board.cols,
+                                  board.has_left, board.has_right)
+
+    def ordering(self, to_move: bool, order: List[int]) -> List[int]:
+        '''
+        Return the cell indices in the order to try them: by the potential
+        the move takes from the opponent (the score of compute_optimal_move),
+        then by the potential it adds for the player to move. Positions
+        ORDER_DEPTH or more moves deep keep their parent's order.
+        '''
+        if self.trackers is None or len(self.line) >= ORDER_DEPTH:
+            return order
+        for i, player in self.line:
+            cell = self.board.cells[i]
+            self.trackers[player].claim(cell)
+            self.trackers[not player].block(cell)
+        own, other = self.trackers[to_move], self.trackers[not to_move]
+        cells = self.board.cells
+        order = sorted(order, key=lambda i: (-other.gain(cells[i]),
+                                             -own.gain(cells[i])))
+        for i, player in reversed(self.line):
+            cell = self.board.cells[i]
+            self.trackers[player].unclaim(cell)
+            self.trackers[not player].unblock(cell)
+        return order
+
+    def apply(self, i: int, player: bool) -> None:
+        self.place(i, player)
+        self.line.append((i, player))
+
+    def undo(self, i: int, player: bool) -> None:
+        self.remove(i, player)
+        self.line.pop()
+
+    def expand(self, to_move: bool, order: List[int]):
+        '''
+        Return True or False if the tactics settle whether the player to
+        move wins the current position, and otherwise the moves to search
+        and the order of all cells, both in the order to try them.
+        '''
+        other = not to_move
+        open_mask = self.full & ~(self.masks[RED] | self.masks[BLUE])
+        if self.winning_cells(to_move, open_mask):
+            return True
+        threats = self.winning_cells(other, open_mask)
+        if threats & (threats - 1):
+            return False  # only one of them can be blocked
+        if threats:
+            candidates = threats
+        else:
+            mine = self.reachable(to_move, open_mask)
+            if not mine:
+                return False
+            theirs = self.reachable(other, open_mask)
+            if not theirs:
+                return True
+            vcs, scs = edge_connections(self.board, to_move,
+                                        self.masks[to_move], open_mask)
+            if vcs or scs:
+                return True
+            vcs, scs = edge_connections(self.board, other, self.masks[other],
+                                        open_mask)
+            if vcs:
+                return False
+            candidates = open_mask & (mine | theirs)
+            for carrier in scs:
+                candidates &= carrier  # any other move lets them connect
+            if not candidates:
+                return False
+        order = self.ordering(to_move, order)
+        return [i for i in order if candidates >> i & 1], order
+
+    def search(self, to_move: bool, order: List[int], max_pn: int,
+               max_dn: int) -> None:
+        '''
+        Search the current position until its proof number (how many
+        positions at least are left to prove that the player to move wins)
+        reaches max_pn or its disproof number reaches max_dn, and store
+        both in the table. A position is proved once its proof number is 0
+        and disproved once its disproof number is.
+        '''
+        key = self.hash ^ self.side[to_move]
+        self.probes += 1
+        expanded = self.expanded.get(key)
+        if expanded is None:
+            self.nodes += 1
+            if self.max_nodes is not None and self.nodes > self.max_nodes:
+                raise NodeLimitReached(self.nodes)
+            expanded = self.expand(to_move, order)
+            if expanded is True or expanded is False:
+                self.table[key] = (0, INFINITY) if expanded else (INFINITY, 0)
+                return
+            self.expanded[key] = expanded
+        else:
+            self.hits += 1
+        moves, order = expanded
+
+        # a move wins if its position is disproved for the opponent, so
+        # the proof number is the least disproof number of the moves, and
+        # the disproof number the sum of their proof numbers
+        other = not to_move
+        keys = [key ^ self.keys[to_move][i] ^ self.side[to_move]
+                ^ self.side[other] for i in moves]
+        table = self.table
+        while True:
+            dn = 0
+            best = 0
+            best_dn = second_dn = INFINITY
+            for j, child in enumerate(keys):
+                child_pn, child_dn = table.get(child, (1, 1))
+                dn += child_pn
+                if child_dn < best_dn:
+                    best, best_dn, second_dn = j, child_dn, best_dn
+                elif child_dn < second_dn:
+                    second_dn = child_dn
+            pn = best_dn
+            dn = min(dn, INFINITY)
+            if pn >= max_pn or dn >= max_dn:
+                table[key] = (pn, dn)
+                return
+            child_pn = table.get(keys[best], (1, 1))[0]
+            i = moves[best]
+            self.apply(i, to_move)
+            self.search(other, order, max_dn - dn + child_pn,
+                        min(max_pn, int(second_dn * (1 + EPSILON)) + 1))
+            self.undo(i, to_move)
+
+    def wins(self, to_move: bool) -> bool:
+        ''' Return whether the player to move wins the current position. '''
+        self.search(to_move, self.central, INFINITY, INFINITY)
+        return self.table[self.hash ^ self.side[to_move]][0] == 0
+
+    def winning_moves(self, to_move: bool) -> List[Tuple[int, int]]:
+        '''
+        Return every open cell whose move wins for the player to move, in
+        the order of get_open_tiles.
+        '''
+        board = self.board
+        other = not to_move
+        open_mask = self.full & ~(self.masks[RED] | self.masks[BLUE])
+        immediate = self.winning_cells(to_move, open_mask)
+        useful = (self.reachable(to_move, open_mask)
+                  | self.reachable(other, open_mask))
+        dead_wins = None  # a dead cell is as good as passing
+        winning = []
+        for cell in board.open_order:
+            i = board.index[cell]
+            if not open_mask >> i & 1:
+                continue
+            if immediate >> i & 1:
+                winning.append(cell)
+                continue
+            if not useful >> i & 1:
+                if dead_wins is None:
+                    dead_wins = not self.wins(other)
+                if dead_wins:
+                    winning.append(cell)
+                continue
+            self.apply(i, to_move)
+            if not self.wins(other):
+                winning.append(cell)
+            self.undo(i, to_move)
+        return winning
+
+    def hit_rate(self) -> float:
+        return self.hits / self.probes if self.probes else 0.0
+
+
+def solve(rows: int, cols: int, red_moves: Set[Tuple[int, int]],
+          blue_moves: Set[Tuple[int, int]], player: bool,
+          red_paths: Iterable[Set[Tuple[int, int]]] = None,
+          blue_paths: Iterable[Set[Tuple[int, int]]] = None,
+          max_nodes: int = None) -> Dict:
+    '''
+    Return the winning moves of player in the given position (None if
+    that takes more than max_nodes nodes), with the number of nodes
+    searched, the transposition table's hit rate and the time taken.
+    '''
+    start = time.perf_counter()
+    solver = Solver(rows, cols, red_moves, blue_moves, red_paths, blue_paths,
+                    max_nodes)
+    try:
+        winning = solver.winning_moves(player)
+    except NodeLimitReached:
+        winning = None
+    return {'winning_moves': winning, 'nodes': solver.nodes,
+            'table_size': len(solver.table), 'hit_rate': solver.hit_rate(),
+            'seconds': time.perf_counter() - start}
+
+
+if __name__ == "__main__":
+    from polygon_puzzles import puzzles
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('puzzle_number', type=int, nargs='*',
+                        help='the puzzle ID numbers (by default all puzzles '
+                             'of at most --max-size rows and columns)')
+    parser.add_argument('--max-size', type=int, default=7,
+                        help='largest grid solved when no puzzle is given')
+    parser.add_argument('--player', choices=['red', 'blue'], default='blue',
+                        help='the player to move')
+    parser.add_argument('--max-nodes', type=int, default=MAX_NODES,
+                        help='give up on a puzzle after this many nodes')
+    args = parser.parse_args()
+    numbers = args.puzzle_number or [
+        n for n in sorted(puzzles)
+        if max(puzzles[n][0], puzzles[n][1]) <= args.max_size]
+    if not set(numbers) <= set(puzzles):
+        parser.error('unknown puzzle number(s): ' + str(
+            sorted(set(numbers) - set(puzzles))))
+    player = RED if args.player == 'red' else BLUE
+
+    total_nodes = 0
+    total_seconds = 0.0
+    solved = 0
+    for n in numbers:
+        rows, cols, red_cells, blue_cells = puzzles[n]
+        red_moves, blue_moves = set(red_cells), set(blue_cells)
+        red_paths = find_paths(rows, cols, blue_cells, RED, False).paths
+        blue_paths = find_paths(rows, cols, red_cells, BLUE, False).paths
+        potential_move, _ = compute_optimal_move(rows, cols, red_moves,
+                                                 blue_moves, red_paths,
+                                                 blue_paths, player,
+                                                 'tracker')
+        result = solve(rows, cols, red_moves, blue_moves, player, red_paths,
+                       blue_paths, args.max_nodes)
+        winning = result['winning_moves']
+        if winning is None:
+            verdict = "unsolved"
+        elif not winning:
+            verdict = "lost position"
+        elif potential_move in winning:
+            verdict = "potential strategy wins"
+        else:
+            verdict = "potential strategy loses"
+        print("puzzle %d (%dx%d): %s; winning moves %s, potential move %s"
+              % (n, rows, cols, verdict,
+                 "unknown" if winning is None else winning, potential_move))
+        print("    %d nodes, table hit rate %.1f%%, %.2f s"
+              % (result['nodes'], 100 * result['hit_rate'], result['seconds']))
+        total_nodes += result['nodes']
+        total_seconds += result['seconds']
+        solved += winning is not None
+    print("\n%d of %d puzzles solved, %d nodes in %.2f s"
+          % (solved, len(numbers), total_nodes, total_seconds))
@@ -0,0 +1,409 @@
+import functools
+import importlib.util
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+from collections import Counter
+
+from hex import BLUE, RED, build_path_zdd, cell_frequencies, \
+                compute_optimal_move, compute_optimal_move_tracked, \
+                count_path_lengths, find_paths, flood, get_board, \
+                get_open_tiles, iter_paths, length_histogram
+from path_cache import CACHE_VERSION, PathCache
+from polygon_puzzles import puzzles
+from path_index import PathIndex
+from potential import PotentialTracker
+from position_cache import PositionCache
+from puzzle_generator import PathFilter, PuzzleFilter
+from solver import Solver
+
+
+# cells avoided on the small grids the path searches are checked on
+AVOIDED = [[], [(1, 1)], [(0, 2), (2, 1)], [(1, 0), (3, 2), (2, 4)]]
+
+
+class PathZDDTest(unittest.TestCase):
+    def test_zdd_matches_listed_paths(self):
+        for n in (3, 4, 5):
+            for cells in AVOIDED:
+                for player in (RED, BLUE):
+                    listed = find_paths(n, n, cells, player, not cells)
+                    zdd = build_path_zdd(n, n, cells, player)
+                    self.assertEqual(set(map(frozenset, zdd)),
+                                     set(map(frozenset, listed.paths)))
+
+    def test_counts_match_listed_lengths(self):
+        for n in (3, 4, 5):
+            for cells in AVOIDED:
+                for player in (RED, BLUE):
+                    listed = find_paths(n, n, cells, player, True)
+                    counted = count_path_lengths(n, n, cells, player)
+                    zdd = build_path_zdd(n, n, cells, player)
+                    self.assertEqual(counted.all_lengths, listed.all_lengths)
+                    self.assertEqual(counted.lengths_avoiding_cell,
+                                     listed.lengths_avoiding_cell)
+                    self.assertEqual(zdd.count_by_size(),
+                                     listed.lengths_avoiding_cell if cells
+                                     else listed.all_lengths)
+
+
+class SearchTestCase(unittest.TestCase):
+    def assertSameSearch(self, found, listed):
+        self.assertEqual(sorted(map(sorted, found.paths)),
+                         sorted(map(sorted, listed.paths)))
+        self.assertEqual(found.all_lengths, listed.all_lengths)
+        self.assertEqual(found.lengths_avoiding_cell,
+                         listed.lengths_avoiding_cell)
+
+
+class PathSearchTest(SearchTestCase):
+    def test_bitmask_and_pruned_searches_match_set_search(self):
+        for rows, cols in ((3, 3), (4, 4), (5, 5), (3, 5), (5, 4)):
+            for cells in AVOIDED:
+                for player in (RED, BLUE):
+                    for returning_all in (False, True):
+                        listed = find_paths(rows, cols, cells, player,
+                                            returning_all)
+                        self.assertSameSearch(
+                            find_paths(rows, cols, cells, player,
+                                       returning_all, use_bitmask=True),
+                            listed)
+                        self.assertSameSearch(
+                            find_paths(rows, cols, cells, player,
+                                       returning_all, pruning=True), listed)
+                        self.assertSameSearch(
+                            find_paths(rows, cols, cells, player,
+                                       returning_all, workers=2), listed)
+                        # symmetric needs returning_all or nothing to avoid
+                        if returning_all or not cells:
+                            self.assertSameSearch(
+                                find_paths(rows, cols, cells, player,
+                                           returning_all, symmetric=True),
+                                listed)
+
+
+class PathSummaryTest(unittest.TestCase):
+    def test_summaries_match_listed_paths(self):
+        for rows, cols in ((4, 4), (3, 5)):
+            for cells in AVOIDED[:3]:
+                for player in (RED, BLUE):
+                    paths = find_paths(rows, cols, cells, player,
+                                       not cells).paths
+                    lengths = Counter(len(p) for p in paths)
+                    frequencies = Counter(c for p in paths for c in p)
+                    for as_masks in (False, True):
+                        self.assertEqual(length_histogram(iter_paths(
+                            rows, cols, cells, player, not cells,
+                            as_masks)), lengths)
+                    self.assertEqual(cell_frequencies(iter_paths(
+                        rows, cols, cells, player, not cells)), frequencies)
+                    self.assertEqual(cell_frequencies(paths), frequencies)
+
+
+class PathCacheTest(SearchTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = PathCache(self.directory)
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        for rows, cols in ((3, 3), (8, 8), (5, 13)):
+            # 5 x 13 needs two words per mask
+            masks = [rng.getrandbits(rows * cols) for _ in range(20)]
+            key = (rows, cols, 5, True, False, False)
+            self.cache.put(*key, masks, {3: 4, 5: 16}, {5: 2})
+            self.assertEqual(self.cache.get(*key),
+                             (masks, {3: 4, 5: 16}, {5: 2}))
+            self.assertIsNone(self.cache.get(rows, cols, 5, True, True,
+                                             False))
+
+    def test_searches_are_looked_up(self):
+        for player in (RED, BLUE):
+            for cells in AVOIDED[:3]:
+                listed = find_paths(4, 4, cells, player, not cells)
+                for _ in range(2):  # stored, then read back
+                    found = find_paths(4, 4, cells, player, not cells,
+                                       cache=self.cache)
+                    self.assertSameSearch(found, listed)
+
+    def test_other_versions_are_removed(self):
+        key = (3, 3, 0, False, True, False)
+        self.cache.put(*key, [7], {3: 1}, {})
+        filename = self.cache.filename(*key)
+        with open(filename, 'r+b') as f:
+            f.seek(4)
+            f.write(struct.pack('<H', CACHE_VERSION + 1))
+        self.assertIsNone(self.cache.get(*key))
+        self.assertFalse(os.path.exists(filename))
+
+    def test_truncated_entries_are_missed(self):
+        key = (5, 13, 0, False, True, False)
+        self.cache.put(*key, [1 << 64, 3], {5: 2}, {})
+        filename = self.cache.filename(*key)
+        with open(filename, 'rb') as f:
+            data = f.read()
+        for size in (0, 10, len(data) - 1):
+            with open(filename, 'wb') as f:
+                f.write(data[:size])
+            self.assertIsNone(self.cache.get(*key))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [(3, 3, mask, True, False, False) for mask in range(4)]
+        for i, key in enumerate(keys):
+            self.cache.put(*key, [7] * 100, {3: 100}, {3: 100})
+            os.utime(self.cache.filename(*key), (i, i))
+        size = os.path.getsize(self.cache.filename(*keys[0]))
+        self.cache.get(*keys[0])  # now the most recently used
+        self.cache.max_bytes = 3 * size
+        self.cache.evict()
+        self.assertEqual([os.path.exists(self.cache.filename(*key))
+                          for key in keys], [True, False, True, True])
+
+
+class BackendTest(unittest.TestCase):
+    @unittest.skipIf(importlib.util.find_spec('numpy') is None,
+                     'numpy is not installed')
+    def test_numpy_matches_sets(self):
+        for rows, cols, red_cells, blue_cells in puzzles.values():
+            if rows * cols > 5 * 5:
+                continue
+            red_paths = find_paths(rows, cols, blue_cells, RED, False).paths
+            blue_paths = find_paths(rows, cols, red_cells, BLUE, False).paths
+            for turn in (RED, BLUE):
+                move, potential = compute_optimal_move(
+                    rows, cols, set(red_cells), set(blue_cells), red_paths,
+                    blue_paths, turn, 'numpy')
+                expected_move, expected_potential = compute_optimal_move(
+                    rows, cols, set(red_cells), set(blue_cells), red_paths,
+                    blue_paths, turn, 'sets')
+                self.assertEqual(move, expected_move)
+                self.assertAlmostEqual(potential, expected_potential)
+
+    def test_trackers_match_sets_through_a_game(self):
+        rng = random.Random(0)
+        for rows, cols in ((4, 4), (4, 5), (5, 5)):
+            red_moves, blue_moves = set(), set()
+            trackers = {
+                RED: PotentialTracker(find_paths(rows, cols, [], RED,
+                                                 True).paths),
+                BLUE: PotentialTracker(find_paths(rows, cols, [], BLUE,
+                                                  True).paths)}
+            player = BLUE
+            open_tiles = get_open_tiles(rows, cols, red_moves, blue_moves)
+            while len(open_tiles) > 1:
+                move, potential = compute_optimal_move_tracked(
+                    trackers[not player], open_tiles)
+                red_paths = find_paths(rows, cols, list(blue_moves), RED,
+                                       not blue_moves).paths
+                blue_paths = find_paths(rows, cols, list(red_moves), BLUE,
+                                        not red_moves).paths
+                expected_move, expected_potential = compute_optimal_move(
+                    rows, cols, set(red_moves), set(blue_moves), red_paths,
+                    blue_paths, player, 'sets')
+                self.assertEqual(move, expected_move)
+                self.assertAlmostEqual(potential, expected_potential)
+
+                # the game goes on with a random move
+                move = rng.choice(open_tiles)
+                (red_moves if player == RED else blue_moves).add(move)
+                trackers[player].claim(move)
+                trackers[not player].block(move)
+                player = not player
+                open_tiles = get_open_tiles(rows, cols, red_moves,
+                                            blue_moves)
+
+
+class PathIndexTest(unittest.TestCase):
+    def assertSameIndex(self, index, fresh):
+        self.assertEqual(list(index), list(fresh))
+        self.assertEqual(len(index), len(fresh))
+        self.assertEqual(index.lengths, fresh.lengths)
+
+    def test_undo_restores_the_index(self):
+        rng = random.Random(0)
+        paths = find_paths(5, 5, [], RED, True).paths
+        cells = list(get_board(5, 5).cells)
+        index = PathIndex(paths)
+        blocked = []
+        for _ in range(200):
+            if blocked and rng.random() < 0.4:
+                index.undo()
+                blocked.pop()
+            else:
+                cell = rng.choice(cells)
+                index.block(cell)
+                blocked.append(cell)
+            self.assertSameIndex(index, PathIndex(
+                p for p in paths if not p & set(blocked)))
+        while blocked:
+            index.undo()
+            blocked.pop()
+        self.assertSameIndex(index, PathIndex(paths))
+        self.assertEqual(index.history, [])
+
+
+def has_won(board, mask, player):
+    start, goal = board.edges(player)
+    return bool(flood(mask & start, mask, board.cols, board.has_left,
+                      board.has_right, goal) & goal)
+
+
+def winning_moves(rows, cols, red_moves, blue_moves, player):
+    ''' The moves that win for player, by searching the whole game tree. '''
+    board = get_board(rows, cols)
+    full = (1 << rows * cols) - 1
+
+    @functools.lru_cache(maxsize=None)
+    def wins(masks, player):
+        # whether player, to move, wins
+        open_mask = full & ~(masks[RED] | masks[BLUE])
+        return any(move_wins(masks, player, i) for i in range(rows * cols)
+                   if open_mask >> i & 1)
+
+    def move_wins(masks, player, i):
+        masks = dict(enumerate(masks))
+        masks[player] |= 1 << i
+        return has_won(board, masks[player], player) \
+            or not wins((masks[0], masks[1]), not player)
+
+    masks = [0, 0]
+    for p, moves in ((RED, red_moves), (BLUE, blue_moves)):
+        for cell in moves:
+            masks[p] |= 1 << board.index[cell]
+    return [cell for cell in board.open_order
+            if cell not in red_moves and cell not in blue_moves
+            and move_wins(tuple(masks), player, board.index[cell])]
+
+
+class ConnectivityTest(unittest.TestCase):
+    def test_wins_match_flood_fill(self):
+        rng = random.Random(0)
+        for rows, cols in ((1, 1), (3, 3), (4, 6), (6, 4), (7, 7)):
+            board = get_board(rows, cols)
+            for _ in range(20):
+                connectivity = board.connectivity(set(), set())
+                cells = list(board.cells)
+                rng.shuffle(cells)
+                masks = [0, 0]
+                for turn, cell in enumerate(cells):
+                    player = RED if turn % 2 else BLUE
+                    masks[player] |= 1 << board.index[cell]
+                    self.assertEqual(connectivity.add(cell, player),
+                                     has_won(board, masks[player], player))
+                    self.assertEqual(connectivity.has_won(not player),
+                                     has_won(board, masks[not player],
+                                             not player))
+
+
+def load_tic_tac_toe():
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'tic-tac-toe.py')
+    spec = importlib.util.spec_from_file_location('tic_tac_toe', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TicTacToeTest(unittest.TestCase):
+    def test_counters_match_a_recount(self):
+        Board = load_tic_tac_toe().Board
+        rng = random.Random(0)
+        for n in (3, 4, 5):
+            for _ in range(20):
+                board = Board(n)
+                symbol = 'X'
+                over = False
+                while not over:
+                    board.add_move(rng.choice(board.get_open_cells()), symbol)
+                    symbols = [[board.cells[x][y] for x, y in line]
+                               for line in board.lines]
+                    x_count = [line.count('X') for line in symbols]
+                    o_count = [line.count('O') for line in symbols]
+                    dead = [int(x > 0 and o > 0)
+                            for x, o in zip(x_count, o_count)]
+                    self.assertEqual(board.x_count, x_count)
+                    self.assertEqual(board.o_count, o_count)
+                    self.assertEqual(list(board.dead), dead)
+                    self.assertEqual(board.num_live, dead.count(0))
+                    self.assertEqual(board.winner, symbol
+                                     if n in x_count + o_count else None)
+                    self.assertAlmostEqual(board.compute_danger(), sum(
+                        0.5 ** (n - x) for x, o in zip(x_count, o_count)
+                        if not o))
+                    over, _ = board.check_for_win()
+                    symbol = 'O' if symbol == 'X' else 'X'
+
+
+class SolverTest(unittest.TestCase):
+    def test_solver_matches_game_tree_search(self):
+        rng = random.Random(0)
+        checked = 0
+        while checked < 100:
+            rows, cols = rng.choice([(3, 3), (3, 4), (4, 3), (4, 4)])
+            board = get_board(rows, cols)
+            cells = list(board.cells)
+            rng.shuffle(cells)
+            stones = rng.randint(rows * cols - 10, rows * cols - 4)
+            red = set(cells[:stones // 2])
+            blue = set(cells[stones // 2:stones])
+            if any(has_won(board, sum(1 << board.index[c] for c in moves), p)
+                   for p, moves in ((RED, red), (BLUE, blue))):
+                continue
+            player = rng.choice([RED, BLUE])
+            expected = winning_moves(rows, cols, red, blue, player)
+            red_paths = find_paths(rows, cols, list(blue), RED, False).paths
+            blue_paths = find_paths(rows, cols, list(red), BLUE, False).paths
+            for solver in (Solver(rows, cols, red, blue),
+                           Solver(rows, cols, red, blue, red_paths,
+                                  blue_paths)):
+                self.assertEqual(solver.winning_moves(player), expected)
+            checked += 1
+
+
+class PuzzleFilterTest(unittest.TestCase):
+    red = [(0, 3), (1, 4), (2, 2), (3, 1), (4, 0)]
+    blue = [(0, 0), (1, 0), (2, 0), (3, 2), (3, 4)]
+
+    def setUp(self):
+        self.filter = PuzzleFilter(PathFilter(5, 5))
+        self.assertIsNotNone(self.filter.accept([5, 5, self.red, self.blue]))
+
+    def test_rotated_copy_is_dropped(self):
+        turn = lambda cells: [(4 - x, 4 - y) for x, y in cells]
+        puzzle = [5, 5, turn(self.red), turn(self.blue)]
+        self.assertIsNone(self.filter.accept(puzzle))
+        self.assertEqual(self.filter.rejected['duplicate'], 1)
+
+    def test_colour_swapped_copy_is_kept(self):
+        # the same stones with Red to move, so a different puzzle
+        flip = lambda cells: [(y, x) for x, y in cells]
+        self.filter.accept([5, 5, flip(self.blue), flip(self.red)])
+        self.assertEqual(self.filter.rejected['duplicate'], 0)
+        self.assertEqual(self.filter.rejected['potential'], 1)
+
+
+class PositionCacheTest(unittest.TestCase):
+    def test_malformed_entries_are_skipped(self):
+        good = ['tracker', 3, 3, 1, 2, True, 1, 1, 0.5]
+        entries = [good, good[:5], 7,
+                   ['tracker', 3, 3, [1], 2, True, 0, 0, 0.5],
+                   ['tracker', 3, 3, 4, 2, True, 0.5, 0, 0.5],
+                   ['tracker', 3, 3, 8, 2, True, 0, '1', 0.5],
+                   ['tracker', 3, 3, 16, 2, True, 0, 0, 'high'],
+                   ['tracker', '3', 3, 32, 2, True, 0, 0, 0.5]]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'positions.json')
+            with open(filename, 'w') as f:
+                json.dump({'version': 1, 'entries': entries}, f)
+            cache = PositionCache(filename=filename)
+        self.assertEqual(dict(cache.entries),
+                         {('tracker', 3, 3, 1, 2, True): ((1, 1), 0.5)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,41 @@
 import argparse, os, random
+from potential import PotentialTracker
 
 
 class Board:
+    # Every winning line has an integer id: its cells are lines[id], and
+    # x_count[id] and o_count[id] count the X's and O's on it. A line is
+    # dead once it holds both, and lines_through[cell] lists the ids of
+    # the lines through cell, so a move only touches those lines.
     def __init__(self, n):
         self.size = n
         self.cells = [[' ' for _ in range(n)] for _ in range(n)]
-        self.winning_lines = []
-        
+        self.lines = []
+
         # add winning rows
         for i in range(n):
-            self.winning_lines.append([])
-            for j in range(n):
-                self.winning_lines[-1].append((i, j))
-                
+            self.lines.append(tuple((i, j) for j in range(n)))
+
         # add winning columns
         for i in range(n):
-            self.winning_lines.append([])
-            for j in range(n):
-                self.winning_lines[-1].append((j, i))
-                
+            self.lines.append(tuple((j, i) for j in range(n)))
+
         # add winning diagonal lines
-        self.winning_lines.append([])
-        for i in range(n):
-            self.winning_lines[-1].append((i, i))
-        self.winning_lines.append([])
-        for i in range(n):
-            self.winning_lines[-1].append(((n-1)-i, i))
+        self.lines.append(tuple((i, i) for i in range(n)))
+        self.lines.append(tuple(((n-1)-i, i) for i in range(n)))
+
+        self.lines_through = {}
+        for line_id, line in enumerate(self.lines):
+            for cell in line:
+                self.lines_through.setdefault(cell, []).append(line_id)
+        self.x_count = [0] * len(self.lines)
+        self.o_count = [0] * len(self.lines)
+        self.dead = bytearray(len(self.lines))
+        self.num_live = len(self.lines)
+        self.winner = None
+
+        # player x's potential, updated as moves are added
+        self.tracker = PotentialTracker(self.lines)
 
     def __str__(self):
         result = ''
@@ -67,52 +77,37 @@ class Board:
         # for simplicity, we only compute player x danger
         # = sum of (1/2)^(# of open cells remaining
         # in line that contains no o's)
-        danger = 0
-        for line in self.winning_lines:
-            if 'O' not in line:
-                danger += (1/2)**(len(line) - line.count('X'))
-        return danger
+        return self.tracker.potential()
 
     def get_optimal_move(self):
         # maximize the value we subtract from the "danger" function
-        open_cells = self.get_open_cells()
-        best_move = open_cells[0]
-        best_move_val = 0
-
-        for pos in open_cells:
-            val = 0
-            for line in self.winning_lines:
-                if pos in line and 'O' not in line:
-                    val += (1/2)**(len(line) - line.count('X'))
-            if val > best_move_val:
-                best_move = pos
-                best_move_val = val
-
+        best_move, _ = self.tracker.best_cell(self.get_open_cells())
         return best_move
 
     def add_move(self, position, symbol):
-        # in all lines, replace position with symbol
-        for i in range(len(self.winning_lines)):
-            for j in range(len(self.winning_lines[i])):
-                if self.winning_lines[i][j] == position:
-                    self.winning_lines[i][j] = symbol
-
-        # remove winning lines that contain both symbols
-        temp = list(filter(lambda lst: not('X' in lst and 'O' in lst), self.winning_lines))
-        self.winning_lines = temp
+        own, other = (self.x_count, self.o_count) if symbol == 'X' \
+            else (self.o_count, self.x_count)
+        for line_id in self.lines_through[position]:
+            own[line_id] += 1
+            if own[line_id] == self.size:
+                self.winner = symbol
+            # kill lines that now contain both symbols
+            if other[line_id] and not self.dead[line_id]:
+                self.dead[line_id] = 1
+                self.num_live -= 1
 
         # add move to board
         self.cells[position[0]][position[1]] = symbol
+        if symbol == 'X':
+            self.tracker.claim(position)
+        else:
+            self.tracker.block(position)
 
     def check_for_win(self):
-        if len(self.winning_lines) == 0:
+        if self.winner is not None:
+            return True, 'Player ' + self.winner
+        if self.num_live == 0:
             return True, 'No one'
-
-        for line in self.winning_lines:
-            if line.count('X') == len(line):
-                return True, 'Player X'
-            elif line.count('O') == len(line):
-                return True, 'Player O'
         return False, None
 
 
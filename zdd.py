@@ -0,0 +1,193 @@
+"""
+Zero-suppressed decision diagrams (ZDDs) for families of sets of cells.
+"""
+from typing import Dict, Hashable, Iterable, Iterator, List, Sequence, Set, \
+                   Tuple
+
+BOTTOM = 0  # the empty family
+TOP = 1  # the family containing only the empty set
+LENGTH_BITS = 128  # bits per coefficient of a packed length polynomial
+
+
+def unpack_lengths(packed: int) -> Dict[int, int]:
+    '''
+    Return the length distribution packed into one integer, LENGTH_BITS
+    bits per length, lowest length first.
+    '''
+    lengths = {}
+    mask = (1 << LENGTH_BITS) - 1
+    length = 0
+    while packed:
+        if packed & mask:
+            lengths[length] = packed & mask
+        packed >>= LENGTH_BITS
+        length += 1
+    return lengths
+
+
+class NodeTable:
+    '''
+    Storage for the nodes of one or more ZDDs. Node n tests variable
+    var[n]; lo[n] holds the sets without that variable and hi[n] the sets
+    with it. A node is always created after its children, so children
+    have smaller ids than their parents.
+    '''
+    def __init__(self, num_vars: int) -> None:
+        self.var = [num_vars, num_vars]  # terminals come after every variable
+        self.lo = [BOTTOM, TOP]
+        self.hi = [BOTTOM, TOP]
+        self.unique: Dict[Tuple[int, int, int], int] = {}
+
+    def make_node(self, var: int, lo: int, hi: int) -> int:
+        if hi == BOTTOM:
+            return lo  # zero-suppression rule
+        key = (var, lo, hi)
+        node = self.unique.get(key)
+        if node is None:
+            node = len(self.var)
+            self.var.append(var)
+            self.lo.append(lo)
+            self.hi.append(hi)
+            self.unique[key] = node
+        return node
+
+
+class ZDD:
+    '''
+    A family of sets of cells, where variable i stands for cells[i].
+
+    Families derived from one another (e.g. by restrict) share a NodeTable.
+    Weights are integers scaled by 2^len(cells), like the weights of a
+    PotentialTracker, so potentials compare exactly.
+    '''
+    def __init__(self, cells: Sequence[Hashable], root: int = BOTTOM,
+                 table: NodeTable = None) -> None:
+        self.cells = tuple(cells)
+        self.index = {cell: i for i, cell in enumerate(self.cells)}
+        self.root = root
+        self.table = table if table is not None else NodeTable(len(cells))
+
+    def derive(self, root: int) -> 'ZDD':
+        family = ZDD.__new__(ZDD)
+        family.cells = self.cells
+        family.index = self.index
+        family.root = root
+        family.table = self.table
+        return family
+
+    def nodes(self) -> List[int]:
+        ''' Return the non-terminal nodes of the family, children first. '''
+        lo, hi = self.table.lo, self.table.hi
+        seen = set()
+        stack = [self.root]
+        while stack:
+            n = stack.pop()
+            if n > TOP and n not in seen:
+                seen.add(n)
+                stack.append(lo[n])
+                stack.append(hi[n])
+        return sorted(seen)
+
+    def __len__(self) -> int:
+        counts = {BOTTOM: 0, TOP: 1}
+        lo, hi = self.table.lo, self.table.hi
+        for n in self.nodes():
+            counts[n] = counts[lo[n]] + counts[hi[n]]
+        return counts[self.root]
+
+    def __iter__(self) -> Iterator[Set[Hashable]]:
+        var, lo, hi = self.table.var, self.table.lo, self.table.hi
+        stack = [(self.root, ())]
+        while stack:
+            n, chosen = stack.pop()
+            if n == TOP:
+                yield {self.cells[v] for v in chosen}
+            elif n != BOTTOM:
+                stack.append((lo[n], chosen))
+                stack.append((hi[n], chosen + (var[n],)))
+
+    def __repr__(self) -> str:
+        return 'ZDD(%d sets, %d nodes)' % (len(self), len(self.nodes()))
+
+    def count_by_size(self) -> Dict[int, int]:
+        ''' Return the number of sets of each size. '''
+        lo, hi = self.table.lo, self.table.hi
+        packed = {BOTTOM: 0, TOP: 1}
+        for n in self.nodes():
+            packed[n] = packed[lo[n]] + (packed[hi[n]] << LENGTH_BITS)
+        return unpack_lengths(packed[self.root])
+
+    def restrict(self, cell: Hashable) -> 'ZDD':
+        ''' Return the sets that do not contain cell. '''
+        v = self.index.get(cell)
+        if v is None:
+            return self
+        table = self.table
+        var, lo, hi = table.var, table.lo, table.hi
+        memo = {}
+
+        def walk(n: int) -> int:
+            if var[n] > v:
+                return n
+            if var[n] == v:
+                return lo[n]
+            if n not in memo:
+                memo[n] = table.make_node(var[n], walk(lo[n]), walk(hi[n]))
+            return memo[n]
+
+        return self.derive(walk(self.root))
+
+    def has_subset_of(self, cells: Iterable[Hashable]) -> bool:
+        ''' Return whether some set of the family lies within cells. '''
+        chosen = {self.index[c] for c in cells if c in self.index}
+        var, lo, hi = self.table.var, self.table.lo, self.table.hi
+        seen = set()
+        stack = [self.root]
+        while stack:
+            n = stack.pop()
+            if n == TOP:
+                return True
+            if n != BOTTOM and n not in seen:
+                seen.add(n)
+                stack.append(lo[n])
+                if var[n] in chosen:
+                    stack.append(hi[n])
+        return False
+
+    def weights(self, moves: Iterable[Hashable]) -> Tuple[int, Dict[Hashable, int]]:
+        '''
+        Return the potential of the family, i.e. the sum of
+        (1/2)^(# of cells not in moves) over its sets, and for every cell
+        the same sum over the sets through it, scaled by 2^len(cells).
+        '''
+        taken = {self.index[c] for c in moves if c in self.index}
+        var, lo, hi = self.table.var, self.table.lo, self.table.hi
+        nodes = self.nodes()
+
+        # below[n] = sum of 2^(len(cells) - var[n] - # of cells not taken)
+        # over the sets of the family rooted at n
+        below = {BOTTOM: 0, TOP: 1}
+        for n in nodes:
+            v = var[n]
+            below[n] = (below[lo[n]] << (var[lo[n]] - v)) \
+                       + (below[hi[n]] << (var[hi[n]] - v - (v not in taken)))
+
+        # above[n] = sum over the ways down from the root to n of
+        # 2^(var[n] - # of cells not taken on the way)
+        above = dict.fromkeys(nodes, 0)
+        above[self.root] = 1 << var[self.root]
+        cell_weights = dict.fromkeys(self.cells, 0)
+        for n in reversed(nodes):
+            v = var[n]
+            shift = var[hi[n]] - v - (v not in taken)
+            if lo[n] > TOP:
+                above[lo[n]] += above[n] << (var[lo[n]] - v)
+            if hi[n] > TOP:
+                above[hi[n]] += above[n] << shift
+            cell_weights[self.cells[v]] += (above[n] * below[hi[n]]) << shift
+
+        return below[self.root] << var[self.root], cell_weights
+
+    def potential(self, moves: Iterable[Hashable]) -> float:
+        total, _ = self.weights(moves)
+        return total / (1 << len(self.cells))